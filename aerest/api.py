@@ -11,20 +11,93 @@
 
 """
 
+import json
+import webapp2
+from google.appengine.ext import ndb
+from webob import exc
+
+from aerest.batch import BatchError
+from aerest.metrics import MeteredRoute
+from aerest.metrics import RouteMetrics
+from aerest.resources import NDBResource
+from aerest.routing import CompiledRoute
+
+
+class LazyResource(object):
+    """
+    A resource registered by the dotted import ``path`` of its class. Its
+    routes are built from ``resource_name`` and ``resource_name_plural``
+    alone, the class is only imported by the first request for it.
+
+    The routes are those of ``NDBResource.build_routes``, so the class must
+    not override ``get_routes``.
+    """
+
+    def __init__(self, path, resource_name, resource_name_plural=None):
+        self.path = path
+        self.resource_name = resource_name
+        self.resource_name_plural = resource_name_plural
+
+    def get_routes(self):
+        resource_name_plural = self.resource_name_plural
+        if resource_name_plural is None:
+            resource_name_plural = "{}s".format(self.resource_name)
+        return NDBResource.build_routes(self.path, resource_name_plural)
+
+    def resolve(self):
+        """
+        Imports and returns the resource class.
+        """
+        return webapp2.import_string(self.path)
+
+    def __repr__(self):
+        return '<LazyResource({!r})>'.format(self.path)
+
+
+def resolve_handler(handler):
+    """
+    Returns the handler class of a route whose handler may be given as a
+    dotted import path.
+    """
+    if isinstance(handler, basestring):
+        return webapp2.import_string(handler)
+    return handler
+
 
 class Api(object):
-    def __init__(self):
+    def __init__(self, batch=False, metrics=False):
         self._registry = {}
         self._canonicals = {}
+        # Mount a `/batch` route, see ``BatchHandler``.
+        self._batch = batch
+        # Record the requests of each route in ``metrics`` and mount a
+        # `/_metrics` route, see ``aerest.metrics.MeteredRoute``.
+        self.metrics = RouteMetrics() if metrics else None
+        # The router of the batch operations, built from the registered
+        # resources on the first batch request, see ``BatchHandler``.
+        self._batch_router = None
 
-    def register(self, resource):
+    def register(self, resource, resource_name=None,
+                 resource_name_plural=None):
+        """
+        Registers a resource class. The class may also be given as a dotted
+        import path together with its ``resource_name`` and, if it is not
+        the default, its ``resource_name_plural``. It is then imported by
+        the first request for the resource, see ``LazyResource``.
+        """
+        if isinstance(resource, basestring):
+            if resource_name is None:
+                raise Exception(
+                    "Resource %r must define a 'resource_name'." % resource)
+            resource = LazyResource(
+                resource, resource_name, resource_name_plural)
         resource_name = getattr(resource, 'resource_name', None)
         if resource_name is None:
             raise Exception(
                 "Resource %r must define a 'resource_name'." % resource)
 
         self._registry[resource_name] = resource
-
+        self._batch_router = None
 
     def unregister(self, resource_name):
         """
@@ -36,9 +109,260 @@ class Api(object):
         if resource_name in self._canonicals:
             del(self._canonicals[resource_name])
 
-    def get_routes(self):
+        self._batch_router = None
+
+    def get_resource_routes(self):
+        """
+        Returns the routes of all registered resources.
+        """
         routes_list = []
         for name in sorted(self._registry.keys()):
             routes_list.extend(self._registry[name].get_routes())
 
+        if self.metrics is not None:
+            routes_list = [MeteredRoute.from_route(route, self.metrics)
+                           for route in routes_list]
+        return routes_list
+
+    def get_routes(self, compiled=False):
+        """
+        Returns the routes of the api. If ``compiled`` is set the routes of
+        the resources are returned as a single ``CompiledRoute``, which
+        matches a request without trying each route in turn.
+
+        ``PATCH`` has to be added to the ``allowed_methods`` of the
+        application, see ``NDBResource.get_allowed_methods``.
+        """
+        routes_list = self.get_resource_routes()
+        if compiled:
+            routes_list = [CompiledRoute(routes_list)]
+
+        if self._batch:
+            handler = type('BatchHandler', (BatchHandler,), {'api': self})
+            routes_list.append(webapp2.Route(
+                r'/batch', handler=handler, handler_method='batch',
+                methods=['POST']))
+
+        if self.metrics is not None:
+            handler = type('MetricsHandler', (MetricsHandler,), {'api': self})
+            routes_list.append(webapp2.Route(
+                r'/_metrics', handler=handler, handler_method='metrics',
+                methods=['GET']))
+
         return routes_list
+
+
+class MetricsHandler(webapp2.RequestHandler):
+    """
+    Writes the ``metrics`` of ``api`` in the Prometheus text format.
+    """
+
+    api = None
+
+    def metrics(self, **kwargs):
+        self.response.headers['Content-Type'] = \
+            'text/plain; version=0.0.4; charset=utf-8'
+        self.response.out.write(self.api.metrics.render())
+
+
+class Batch(object):
+    """
+    Collects the writes of the operations of a batch request.
+    """
+
+    def __init__(self):
+        self.futures = []
+        # Index of the operation being dispatched.
+        self.operation = None
+
+    def defer(self, future):
+        self.futures.append((self.operation, future))
+
+
+class BatchHandler(webapp2.RequestHandler):
+    """
+    Runs several operations against the resources of ``api`` in a single
+    request. The body is of the form::
+
+        {"operations": [
+            {"method": "GET", "path": "/people/1"},
+            {"method": "PUT", "path": "/people/2",
+             "body": {"person": {"id": 2, "name": "Bill"}}}
+        ]}
+
+    Each operation is dispatched to the resource's handler, including its
+    authentication and authorization. The request's ``user`` and the
+    ``Authorization`` and ``Cookie`` headers are passed on to the operations.
+
+    The operations are authenticated and authorized, as far as possible
+    without their entities, before anything is read. The entities read by
+    the operations that pass are fetched up front with a single
+    ``get_multi`` and their writes are issued together, so that ndb can send
+    them in as few ``put_multi`` and ``delete_multi`` calls as possible. The
+    response is of the form::
+
+        {"results": [{"status": 200, "body": {...}}, ...]}
+
+    If a write fails the status of its operation is replaced with the error.
+    """
+
+    api = None
+    # Maximum number of operations of a single batch request.
+    max_operations = 50
+    # Headers of the batch request that are copied to each operation.
+    forwarded_headers = ('Authorization', 'Cookie')
+
+    def _router(self):
+        router = self.api._batch_router
+        if router is None:
+            router = webapp2.Router(
+                [CompiledRoute(self.api.get_resource_routes())])
+            self.api._batch_router = router
+        return router
+
+    def _build_request(self, operation, batch):
+        if not isinstance(operation, dict) or 'path' not in operation:
+            raise ValueError(
+                'Each operation must be an object with a "path".')
+        request = webapp2.Request.blank(str(operation['path']))
+        request.method = str(operation.get('method', 'GET')).upper()
+        for name in self.forwarded_headers:
+            if name in self.request.headers:
+                request.headers[name] = self.request.headers[name]
+        for name, value in (operation.get('headers') or {}).iteritems():
+            request.headers[str(name)] = str(value)
+        if operation.get('body') is not None:
+            request.body = json.dumps(operation['body'])
+        request.user = getattr(self.request, 'user', None)
+        request.aerest_batch = batch
+        return request
+
+    def _keys_to_read(self, handler):
+        """
+        Returns the keys the operation of ``handler`` is expected to read.
+        """
+        request = handler.request
+        kwargs = request.route_kwargs
+        resource = type(handler)
+        ids = []
+        if 'id' in kwargs:
+            ids.append(kwargs['id'])
+        elif request.body and request.method in ('GET', 'PUT', 'DELETE'):
+            try:
+                body = json.loads(request.body)
+                if request.method == 'PUT':
+                    ids = [d['id'] for d in
+                           body[resource.resource_name_plural or
+                                '{}s'.format(resource.resource_name)]]
+                else:
+                    ids = body.get('ids') or []
+            except (ValueError, KeyError, TypeError, AttributeError):
+                return []
+        if request.method == 'DELETE' and not handler._requires_objects():
+            # Deleted by key without being read.
+            return []
+        keys = []
+        for id in ids:
+            try:
+                keys.append(ndb.Key(resource.resource_model,
+                                    resource.id_type(id)))
+            except (ValueError, TypeError):
+                pass
+        return keys
+
+    def _check(self, request, match):
+        """
+        Returns the handler of an operation once its request has been
+        checked, see ``NDBResource.check_request``, or the result of the
+        operation if it was denied.
+        """
+        route, args, kwargs = match
+        request.route = route
+        request.route_args = args
+        request.route_kwargs = kwargs
+        try:
+            handler = resolve_handler(route.handler)(
+                request, webapp2.Response())
+            handler.check_request()
+        except exc.HTTPException, e:
+            return {'status': e.code, 'body': None}
+        except Exception, e:
+            return {'status': 500, 'body': {'error': str(e)}}
+        return handler
+
+    def _dispatch(self, handler):
+        response = handler.response
+        try:
+            handler.dispatch()
+        except exc.HTTPException, e:
+            return {'status': e.code, 'body': None}
+        except Exception, e:
+            return {'status': 500, 'body': {'error': str(e)}}
+        body = None
+        if response.body:
+            try:
+                body = json.loads(response.body)
+            except ValueError:
+                body = response.body
+        return {'status': response.status_int, 'body': body}
+
+    def batch(self, **kwargs):
+        try:
+            operations = json.loads(self.request.body)['operations']
+        except (ValueError, KeyError, TypeError):
+            return self.abort(400, detail='Body must contain "operations".')
+        if not isinstance(operations, list):
+            return self.abort(400, detail='"operations" must be a list.')
+        if len(operations) > self.max_operations:
+            return self.abort(400, detail='Too many operations.')
+
+        batch = Batch()
+        router = self._router()
+        requests = []
+        for operation in operations:
+            try:
+                requests.append(self._build_request(operation, batch))
+            except ValueError, e:
+                return self.abort(400, detail=str(e))
+
+        # Either the handler of each operation or its result, if it was
+        # not found or denied.
+        handlers = []
+        keys = []
+        for request in requests:
+            try:
+                handler = self._check(request, router.match(request))
+            except exc.HTTPNotFound:
+                handler = {'status': 404, 'body': None}
+            except exc.HTTPMethodNotAllowed:
+                handler = {'status': 405, 'body': None}
+            handlers.append(handler)
+            if not isinstance(handler, dict):
+                keys.extend(self._keys_to_read(handler))
+
+        # Read everything the operations need at once. The entities end up in
+        # the ndb context cache, where the handlers find them.
+        if keys:
+            ndb.get_multi(keys)
+
+        results = []
+        for i, handler in enumerate(handlers):
+            if isinstance(handler, dict):
+                results.append(handler)
+                continue
+            batch.operation = i
+            results.append(self._dispatch(handler))
+
+        # Wait for the writes of all operations.
+        for i, future in batch.futures:
+            exception = future.get_exception()
+            if isinstance(exception, BatchError):
+                results[i] = {'status': 207,
+                              'body': {'errors': exception.to_list()}}
+            elif exception is not None:
+                results[i] = {'status': 500,
+                              'body': {'error': str(exception)}}
+
+        self.response.headers.add_header(
+            'content-type', 'application/json', charset='utf-8')
+        self.response.out.write(json.dumps({'results': results}))
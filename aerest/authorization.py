@@ -11,12 +11,21 @@
 
 """
 
+from google.appengine.ext import ndb
+
 
 class Authorization(object):
     """
     A base class that provides no permissions checking.
     """
 
+    # Set to ``False`` next to an ``is_authorized`` that ignores the
+    # ``object``, such backends are checked once per request before any
+    # entity is read from the datastore. A backend that overrides
+    # ``is_authorized`` without declaring it is treated as row-level, see
+    # ``needs_object``.
+    requires_object = False
+
     def __get__(self, instance, owner):
         """
         Makes ``Authorization`` a descriptor of ``ResourceOptions`` and creates
@@ -26,6 +35,22 @@ class Authorization(object):
         self.resource_meta = instance
         return self
 
+    @classmethod
+    def needs_object(cls):
+        """
+        Returns ``False`` if the backend declared that ``is_authorized`` does
+        not need the ``object``. The closest class in the MRO that declares
+        ``requires_object`` decides, unless a class before it overrides
+        ``is_authorized``.
+        """
+        for klass in cls.__mro__:
+            attrs = vars(klass)
+            if 'requires_object' in attrs:
+                return attrs['requires_object'] is not False
+            if 'is_authorized' in attrs:
+                return True
+        return True
+
     def is_authorized(self, request, object=None):
         """
         Checks if the user is authorized to perform the request. If ``object``
@@ -36,6 +61,32 @@ class Authorization(object):
         """
         return True
 
+    def filter_query(self, request, query):
+        """
+        Row-level backends may return ``query`` narrowed to the entities the
+        user is authorized to see, so that list requests do not read entities
+        that would be rejected.
+
+        Should return an ``ndb.Query`` or ``None`` if the query cannot be
+        narrowed.
+        """
+        return None
+
+    def is_authorized_many(self, request, objects):
+        """
+        Checks if the user is authorized to perform the request on each of
+        ``objects``.
+
+        Should return a list with a result per object, see ``is_authorized``.
+        By default the request is checked once if the backend declared that
+        it does not need the objects, see ``needs_object``, and
+        ``is_authorized`` is called for each object otherwise; override this
+        to decide for the whole list in one pass.
+        """
+        if not self.needs_object():
+            return [self.is_authorized(request)] * len(objects)
+        return [self.is_authorized(request, o) for o in objects]
+
 
 class ReadAuthorization(Authorization):
     """
@@ -44,6 +95,8 @@ class ReadAuthorization(Authorization):
     Only allows GET requests.
     """
 
+    requires_object = False
+
     def is_authorized(self, request, object=None):
         """
         Allow any ``GET`` request.
@@ -59,6 +112,8 @@ class AdminAuthorization(Authorization):
     Allows a ``User`` with the 'admin' ``roles`` to modify  ``Resource`` objects.
     """
 
+    requires_object = False
+
     def is_authorized(self, request, object=None):
         """
         Allow an admin full access.
@@ -78,21 +133,56 @@ class UserOwnedAuthorization(Authorization):
     Allows a ``User`` with modify resources that they own. For this to work
     the model must have an `owners` property of type list containing the
     Users id.
+
+    If the model has an indexed ``owner_property`` holding the ids of the
+    owners, list queries are filtered by it so that only the user's entities
+    are read. The ids must be strings, e.g. in a
+    ``aerest.properties.DataProperty``, unless the property is an
+    ``ndb.IntegerProperty``.
     """
 
+    requires_object = True
+    owner_property = 'owner_ids'
+
+    def filter_query(self, request, query):
+        if request.user is None:
+            return None
+        model = ndb.Model._kind_map.get(query.kind)
+        prop = getattr(model, '_properties', {}).get(self.owner_property)
+        if prop is None or not prop._indexed:
+            return None
+        user_id = request.user.key.id()
+        if isinstance(prop, ndb.IntegerProperty):
+            try:
+                user_id = int(user_id)
+            except ValueError:
+                return None
+        else:
+            # Untyped properties, like ``DataProperty``, are compared with
+            # the string form of the id.
+            user_id = str(user_id)
+        return query.filter(prop == user_id)
+
     def is_authorized(self, request, object=None):
+        return self.is_authorized_many(request, [object])[0]
+
+    def is_authorized_many(self, request, objects):
 
         # CREATE is always allowed.
         if request.method == 'POST':
-            return True
+            return [True] * len(objects)
 
         # user must be logged in to check permissions
         # authentication backend must set request.user
         if request.user is None:
-            return False
+            return [False] * len(objects)
+
+        user_id = request.user.key.id()
+        return [self._is_owner(o, user_id) for o in objects]
 
+    def _is_owner(self, object, user_id):
         try:
-            is_owner = object.is_owner(request.user.key.id())
+            is_owner = object.is_owner(user_id)
         except Exception:
             raise ("To use the UserOwnedAuthorization you must add "
                    "a 'is_owner()' method to your ResourceModel. "
@@ -111,6 +201,8 @@ class ACLAuthorization(Authorization):
     ``PUT``, and ``DELETE`` to their equivalent django auth permissions.
     """
 
+    requires_object = False
+
     def is_authorized(self, request, object=None):
         # GET is always allowed
         if request.method == 'GET':
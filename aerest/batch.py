@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+    aerest.batch
+    ====================
+
+    Splits large datastore batch calls in to chunks that are run
+    concurrently.
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+from google.appengine.ext import ndb
+
+from aerest.utils import chunks
+
+
+class BatchError(Exception):
+    """
+    Raised when some items of a batch failed. ``results`` holds the results
+    of the items that succeeded and ``errors`` maps the index of each failed
+    item to its exception.
+    """
+
+    def __init__(self, results, errors):
+        self.results = results
+        self.errors = errors
+        super(BatchError, self).__init__(
+            '{} of {} items failed.'.format(
+                len(errors), len(results) + len(errors)))
+
+    def to_list(self):
+        """
+        Returns the errors as a list of ``{'index': i, 'error': message}``
+        dictionaries, sorted by index.
+        """
+        return [{'index': i, 'error': str(self.errors[i])}
+                for i in sorted(self.errors)]
+
+
+@ndb.tasklet
+def _settle(future):
+    """
+    Returns a tuple of ``(result, exception)`` for ``future``.
+    """
+    try:
+        result = yield future
+    except Exception, e:
+        raise ndb.Return((None, e))
+    raise ndb.Return((result, None))
+
+
+@ndb.tasklet
+def map_chunks_async(func, items, size=500, concurrency=4):
+    """
+    Calls ``func`` for each chunk of at most ``size`` items, with up to
+    ``concurrency`` chunks in flight. ``func`` must return a list with a
+    future per item, like ``ndb.put_multi_async``.
+
+    Returns a tuple of ``(results, errors)``. ``results`` has a result per
+    item, ``None`` for items that failed. ``errors`` maps the index of each
+    failed item to its exception.
+    """
+    batches = chunks(items, size)
+    results = []
+    errors = {}
+    for wave in chunks(batches, concurrency):
+        futures = []
+        for batch in wave:
+            futures.extend(func(batch))
+        settled = yield [_settle(f) for f in futures]
+        for result, exception in settled:
+            if exception is not None:
+                errors[len(results)] = exception
+            results.append(result)
+    raise ndb.Return((results, errors))
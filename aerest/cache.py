@@ -0,0 +1,120 @@
+# -*- coding: utf-8 -*-
+"""
+    aerest.cache
+    ====================
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+import json
+
+from google.appengine.ext import ndb
+
+
+def serialize_entity(e):
+    """
+    Returns the JSON encoding of ``e.data``. The id of the entity is added to
+    the data if it is missing.
+    """
+    if not e.data.get('id'):
+        e.data['id'] = e.key.id()
+    return json.dumps(e.data)
+
+
+class EntityCache(object):
+    """
+    Stores the serialized ``data`` of entities in memcache, keyed by kind and
+    id, for ``ttl`` seconds.
+
+    All methods return ``ndb.Future`` objects. The memcache calls go through
+    the ndb context, so concurrent calls are batched.
+    """
+
+    def __init__(self, kind, ttl=60):
+        self.kind = kind
+        self.ttl = ttl
+        self.key_prefix = 'aerest:{}:'.format(kind)
+
+    def _key(self, id):
+        return '{}{}'.format(self.key_prefix, id)
+
+    def get_async(self, id):
+        """
+        Returns the serialized data of the entity with ``id`` or ``None``.
+        """
+        return ndb.get_context().memcache_get(self._key(id))
+
+    def add_async(self, entities):
+        """
+        Caches ``entities`` unless they are already cached. Used when filling
+        the cache on a read, so a read never overwrites a newer write.
+        """
+        ctx = ndb.get_context()
+        return [ctx.memcache_add(self._key(e.key.id()), serialize_entity(e),
+                                 time=self.ttl)
+                for e in entities if e is not None]
+
+    def set_async(self, entities):
+        """
+        Caches ``entities``, replacing what is cached.
+        """
+        ctx = ndb.get_context()
+        return [ctx.memcache_set(self._key(e.key.id()), serialize_entity(e),
+                                 time=self.ttl)
+                for e in entities if e is not None]
+
+    def delete_async(self, ids):
+        """
+        Removes the entities with ``ids`` from the cache.
+        """
+        ctx = ndb.get_context()
+        return [ctx.memcache_delete(self._key(id)) for id in ids]
+
+
+class IdentityMap(object):
+    """
+    The entities read during a single request, keyed by ``ndb.Key``, so that
+    each key is read at most once. ``hits`` and ``misses`` count the lookups
+    that were answered from the map and the keys that had to be read.
+    """
+
+    def __init__(self):
+        self._entities = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        return key in self._entities
+
+    def __getitem__(self, key):
+        return self._entities[key]
+
+    def missing(self, keys):
+        """
+        Returns the keys that are not in the map, without duplicates, and
+        updates the counts.
+        """
+        missing = []
+        seen = set()
+        for key in keys:
+            if key in self._entities:
+                self.hits += 1
+            elif key not in seen:
+                seen.add(key)
+                missing.append(key)
+        self.misses += len(missing)
+        return missing
+
+    def add(self, keys, entities):
+        """
+        Stores ``entities`` by ``keys``. ``None`` marks a key that does not
+        exist.
+        """
+        for key, e in zip(keys, entities):
+            self._entities[key] = e
+
+    def remove(self, keys):
+        for key in keys:
+            self._entities[key] = None
@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+"""
+    aerest.idpool
+    ====================
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+import collections
+import threading
+
+from google.appengine.ext import ndb
+
+
+class IdPool(object):
+    """
+    Hands out ids for ``model`` from ranges reserved with ``allocate_ids``,
+    so that creating an entity does not need an extra datastore round trip.
+
+    Ranges of ``size`` ids are reserved at a time. Once fewer than
+    ``low_water`` ids are left a refill may be started with
+    ``refill_if_low_async``, which can run alongside other RPCs. The pool is
+    shared by all requests of an instance and is safe to use from several
+    threads.
+    """
+
+    def __init__(self, model, size=100, low_water=None):
+        self.model = model
+        self.size = size
+        if low_water is None:
+            low_water = size // 4
+        self.low_water = low_water
+        self._ranges = collections.deque()
+        self._available = 0
+        self._refilling = False
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self._available
+
+    def take(self, n):
+        """
+        Returns a list of ``n`` ids or ``None`` if fewer are available.
+        """
+        with self._lock:
+            if self._available < n:
+                return None
+            ids = []
+            while len(ids) < n:
+                first, last = self._ranges[0]
+                count = min(n - len(ids), last - first + 1)
+                ids.extend(xrange(first, first + count))
+                if first + count > last:
+                    self._ranges.popleft()
+                else:
+                    self._ranges[0] = (first + count, last)
+            self._available -= n
+            return ids
+
+    def _add_range(self, first, last):
+        with self._lock:
+            self._ranges.append((first, last))
+            self._available += last - first + 1
+
+    @ndb.tasklet
+    def refill_async(self, count=None):
+        """
+        Reserves ``count`` more ids, ``size`` by default.
+        """
+        first, last = yield self.model.allocate_ids_async(
+            count or self.size)
+        self._add_range(first, last)
+
+    def refill_if_low_async(self):
+        """
+        Starts a refill if fewer than ``low_water`` ids are left and no other
+        refill is running. Returns a future in any case.
+        """
+        with self._lock:
+            start = self._available < self.low_water and not self._refilling
+            if start:
+                self._refilling = True
+        if not start:
+            future = ndb.Future()
+            future.set_result(None)
+            return future
+        return self._refill_and_reset_async()
+
+    @ndb.tasklet
+    def _refill_and_reset_async(self):
+        try:
+            yield self.refill_async()
+        finally:
+            with self._lock:
+                self._refilling = False
+
+    @ndb.tasklet
+    def take_async(self, n):
+        """
+        Returns a list of ``n`` ids, reserving more if the pool runs out.
+        """
+        ids = self.take(n)
+        while ids is None:
+            yield self.refill_async(max(self.size, n))
+            ids = self.take(n)
+        raise ndb.Return(ids)
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+    aerest.instrumentation
+    ====================
+
+    Records where the time of a request goes: the duration of each phase,
+    the API calls made and the size of the payloads.
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+import collections
+import contextlib
+import logging
+import threading
+import time
+
+from google.appengine.api import apiproxy_stub_map
+
+
+# The ``Instrumentation`` of the request being handled by each thread.
+_local = threading.local()
+
+
+def _pre_call_hook(service, call, request, response):
+    instrumentation = getattr(_local, 'current', None)
+    if instrumentation is not None:
+        instrumentation.start_rpc(service, call, request)
+
+
+def _post_call_hook(service, call, request, response):
+    instrumentation = getattr(_local, 'current', None)
+    if instrumentation is not None:
+        instrumentation.end_rpc(service, call, request)
+
+
+class NullPhase(object):
+    """
+    A phase that records nothing, used when instrumentation is off.
+    """
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class Instrumentation(object):
+    """
+    The measurements of a single request. While it is active, as a context
+    manager, the API calls made by the thread are counted and timed by kind:
+    ``datastore``, ``memcache``, ``allocate_ids`` or the name of any other
+    service.
+
+    ``timings`` and ``rpc_timings`` are in milliseconds. Phases may be
+    nested, e.g. ``render`` is part of ``handler``. The time of an API call
+    runs from the call until its result is checked, so the calls of a kind
+    may overlap and add up to more than the time of the request.
+    """
+
+    def __init__(self):
+        self.timings = collections.OrderedDict()
+        self.rpcs = collections.Counter()
+        self.rpc_timings = collections.Counter()
+        self._rpc_starts = {}
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.status = None
+        self._previous = None
+        self._start = None
+
+    def __enter__(self):
+        # The hook is registered once per apiproxy, ``Append`` ignores a key
+        # that is already present.
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'aerest_instrumentation', _pre_call_hook)
+        apiproxy_stub_map.apiproxy.GetPostCallHooks().Append(
+            'aerest_instrumentation', _post_call_hook)
+        self._previous = getattr(_local, 'current', None)
+        _local.current = self
+        self._start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.timings['total'] = (time.time() - self._start) * 1000.0
+        _local.current = self._previous
+        return False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        """
+        Adds the time spent in the ``with`` block to the phase ``name``.
+        """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0.0) + \
+                (time.time() - start) * 1000.0
+
+    def _rpc_name(self, service, call):
+        if service == 'datastore_v3':
+            return 'allocate_ids' if call == 'AllocateIds' else 'datastore'
+        return service
+
+    def start_rpc(self, service, call, request):
+        self.rpcs[self._rpc_name(service, call)] += 1
+        self._rpc_starts[id(request)] = time.time()
+
+    def end_rpc(self, service, call, request):
+        start = self._rpc_starts.pop(id(request), None)
+        if start is not None:
+            self.rpc_timings[self._rpc_name(service, call)] += \
+                (time.time() - start) * 1000.0
+
+    def server_timing(self):
+        """
+        Returns the value of a `Server-Timing` header.
+        """
+        metrics = ['{};dur={:.2f}'.format(name, duration)
+                   for name, duration in self.timings.iteritems()]
+        metrics.extend('{};dur={:.2f};desc="{} calls"'.format(
+                           name, self.rpc_timings[name], count)
+                       for name, count in sorted(self.rpcs.iteritems()))
+        metrics.append('request-bytes;desc="{}"'.format(self.request_bytes))
+        metrics.append('response-bytes;desc="{}"'.format(self.response_bytes))
+        return ', '.join(metrics)
+
+    def to_dict(self):
+        return {
+            'status': self.status,
+            'timings': dict(self.timings),
+            'rpcs': dict(self.rpcs),
+            'rpc_timings': dict(self.rpc_timings),
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            }
+
+
+class InstrumentationSink(object):
+    """
+    A base class for the receivers of the measurements of instrumented
+    requests, see ``NDBResource.instrumentation_sink``.
+    """
+
+    def emit(self, request, data):
+        """
+        Receives the measurements ``data`` of ``request``, as returned by
+        ``Instrumentation.to_dict``. The default does nothing.
+        """
+
+
+class LoggingSink(InstrumentationSink):
+    """
+    Logs the measurements of each request.
+    """
+
+    level = logging.INFO
+
+    def emit(self, request, data):
+        logging.log(self.level, '%s %s %r', request.method, request.path, data)
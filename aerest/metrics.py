@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+    aerest.metrics
+    ====================
+
+    Request counters and latency histograms by route and method, kept in
+    instance memory and exposed in the Prometheus text format.
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+import bisect
+import threading
+import time
+
+import webapp2
+from webob import exc
+
+
+# Upper bounds, in seconds, of the latency histogram buckets.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace(
+        '\n', '\\n')
+
+
+def _labels(**labels):
+    return ','.join('{}="{}"'.format(name, _escape(labels[name]))
+                    for name in sorted(labels))
+
+
+class RouteMetrics(object):
+    """
+    Counts requests by route, method and status, and records their
+    latencies in histograms with fixed ``buckets`` by route and method.
+    ``observe`` may be called from several threads.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self._lock = threading.Lock()
+        self._requests = {}
+        # Maps ``(route, method)`` to a list of the count of each bucket,
+        # the last one unbounded, followed by the sum of the latencies.
+        self._histograms = {}
+
+    def observe(self, route, method, status, seconds):
+        """
+        Records a request to ``route`` that took ``seconds``.
+        """
+        i = bisect.bisect_left(self.buckets, seconds)
+        series = (route, method)
+        with self._lock:
+            key = (route, method, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+            histogram = self._histograms.get(series)
+            if histogram is None:
+                histogram = [0] * (len(self.buckets) + 1) + [0.0]
+                self._histograms[series] = histogram
+            histogram[i] += 1
+            histogram[-1] += seconds
+
+    def snapshot(self):
+        """
+        Returns copies of the request counts and histograms.
+        """
+        with self._lock:
+            return (dict(self._requests),
+                    dict((k, list(v))
+                         for k, v in self._histograms.iteritems()))
+
+    def render(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        requests, histograms = self.snapshot()
+        lines = [
+            '# HELP aerest_requests_total Requests by route, method and '
+            'status.',
+            '# TYPE aerest_requests_total counter',
+            ]
+        for (route, method, status), count in sorted(requests.iteritems()):
+            lines.append('aerest_requests_total{{{}}} {}'.format(
+                _labels(route=route, method=method, status=status), count))
+
+        lines.extend([
+            '# HELP aerest_request_duration_seconds Request latency by route '
+            'and method.',
+            '# TYPE aerest_request_duration_seconds histogram',
+            ])
+        bounds = ['{!r}'.format(b) for b in self.buckets] + ['+Inf']
+        for (route, method), histogram in sorted(histograms.iteritems()):
+            cumulative = 0
+            for bound, count in zip(bounds, histogram[:-1]):
+                cumulative += count
+                lines.append(
+                    'aerest_request_duration_seconds_bucket{{{}}} {}'.format(
+                        _labels(route=route, method=method, le=bound),
+                        cumulative))
+            labels = _labels(route=route, method=method)
+            lines.append('aerest_request_duration_seconds_sum{{{}}} {!r}'
+                         .format(labels, histogram[-1]))
+            lines.append('aerest_request_duration_seconds_count{{{}}} {}'
+                         .format(labels, cumulative))
+        return '\n'.join(lines) + '\n'
+
+
+class MeteredRoute(webapp2.Route):
+    """
+    A route that records each request it dispatches in ``metrics``, keyed
+    by its template. The handler adapter is wrapped when the router sets it
+    on the first request, so a handler given as an import path is not
+    imported any earlier.
+    """
+
+    metrics = None
+
+    @classmethod
+    def from_route(cls, route, metrics):
+        metered = cls(route.template, handler=route.handler, name=route.name,
+                      defaults=route.defaults, build_only=route.build_only,
+                      handler_method=route.handler_method,
+                      methods=route.methods, schemes=route.schemes)
+        metered.metrics = metrics
+        return metered
+
+    def _get_handler_adapter(self):
+        return self.__dict__.get('_handler_adapter')
+
+    def _set_handler_adapter(self, adapter):
+        if adapter is not None:
+            adapter = _MeteredAdapter(self, adapter)
+        self._handler_adapter = adapter
+
+    handler_adapter = property(_get_handler_adapter, _set_handler_adapter)
+
+
+class _MeteredAdapter(object):
+
+    def __init__(self, route, adapter):
+        self.route = route
+        self.adapter = adapter
+
+    def __call__(self, request, response):
+        start = time.time()
+        status = 500
+        try:
+            result = self.adapter(request, response)
+            status = response.status_int
+            return result
+        except exc.HTTPException, e:
+            status = e.code
+            raise
+        finally:
+            self.route.metrics.observe(
+                self.route.template, request.method, status,
+                time.time() - start)
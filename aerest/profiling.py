@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+"""
+    aerest.profiling
+    ====================
+
+    Runs single requests under ``cProfile``, see ``NDBResource.profiling``.
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+import cProfile
+import pstats
+import StringIO
+import uuid
+
+from google.appengine.api import memcache
+
+
+class Profile(object):
+    """
+    Profiles the calls made through ``runcall`` and formats the ``limit``
+    entries with the highest ``sort`` key.
+    """
+
+    def __init__(self, limit=30, sort='cumulative'):
+        self.limit = limit
+        self.sort = sort
+        self._profiler = cProfile.Profile()
+
+    def runcall(self, func, *args, **kwargs):
+        return self._profiler.runcall(func, *args, **kwargs)
+
+    def format_stats(self):
+        stream = StringIO.StringIO()
+        stats = pstats.Stats(self._profiler, stream=stream)
+        stats.sort_stats(self.sort).print_stats(self.limit)
+        return stream.getvalue()
+
+
+class MemcacheProfileStore(object):
+    """
+    Keeps the formatted stats of profiled requests in memcache for ``ttl``
+    seconds.
+    """
+
+    key_prefix = 'aerest:profile:'
+    ttl = 3600
+
+    def save(self, request, stats):
+        """
+        Stores ``stats`` and returns the id to get them back with.
+        """
+        id = uuid.uuid4().hex
+        memcache.set(self.key_prefix + id, stats, time=self.ttl)
+        return id
+
+    def get(self, id):
+        return memcache.get(self.key_prefix + id)
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+"""
+    aerest.properties
+    ====================
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+from google.appengine.ext import ndb
+
+
+class DataProperty(ndb.ComputedProperty):
+    """
+    An indexed copy of a member of the ``data`` JsonProperty, so that it can
+    be used in queries. e.g.::
+
+        class Person(ndb.Model):
+            data = ndb.JsonProperty()
+            owner_ids = DataProperty('ownerIds', repeated=True)
+
+    The value is computed from ``data`` every time the entity is written.
+    It is stored with the JSON type it has in ``data``, so queries must use
+    the same type, e.g. owner ids stored as strings are matched by
+    ``UserOwnedAuthorization`` but ids stored as numbers are not.
+    """
+
+    def __init__(self, json_key, repeated=False, **kwargs):
+        self._json_key = json_key
+        super(DataProperty, self).__init__(
+            self._get_json_value, repeated=repeated, **kwargs)
+
+    def _get_json_value(self, entity):
+        value = (entity.data or {}).get(self._json_key)
+        if self._repeated and value is None:
+            return []
+        return value
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+    aerest.query
+    ====================
+
+    A small JSON query language that is compiled into ``ndb.Query`` objects.
+
+    A query is a dictionary of the form::
+
+        {
+            "filters": [["name", "=", "Bill"],
+                        ["age", ">=", 18],
+                        ["tags", "in", ["a", "b"]]],
+            "order": ["-age", "name"],
+            "limit": 20
+        }
+
+    Every key is optional. Filters and orders may only reference indexed
+    properties of the model.
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+import operator
+import threading
+
+from google.appengine.api import datastore_errors
+
+
+OPERATORS = {
+    '=': operator.eq,
+    '!=': operator.ne,
+    '<': operator.lt,
+    '<=': operator.le,
+    '>': operator.gt,
+    '>=': operator.ge,
+    'in': lambda prop, value: prop.IN(value),
+    }
+
+# Operators the datastore only allows on a single property per query, which
+# then has to be the first sort order.
+INEQUALITY_OPERATORS = frozenset(['!=', '<', '<=', '>', '>='])
+
+# Accepted spellings of an operator mapped to its canonical form.
+OPERATOR_ALIASES = {
+    '==': '=',
+    'IN': 'in',
+    }
+
+
+class InvalidQuery(Exception):
+    """
+    Raised when a JSON query is malformed or references a property that
+    cannot be queried.
+    """
+
+
+def parse_query(query):
+    """
+    Validates the structure of a JSON ``query`` and splits it in to its
+    shape and its values.
+
+    The shape is a hashable ``(filters, orders)`` tuple that does not depend on
+    the filter values, so that queries that differ only in their values can
+    share a ``CompiledQuery``. Filters are sorted so that the order in which
+    they were given does not matter.
+
+    :return: a tuple of ``(shape, values, limit)``.
+    """
+    if not isinstance(query, dict):
+        raise InvalidQuery('query must be an object.')
+
+    unknown = set(query) - set(['filters', 'order', 'limit'])
+    if unknown:
+        raise InvalidQuery(
+            'Unknown query keys: {}'.format(', '.join(sorted(unknown))))
+
+    filters = []
+    for f in query.get('filters') or []:
+        if not isinstance(f, list) or len(f) != 3:
+            raise InvalidQuery(
+                'filters must be a list of [property, operator, value].')
+        name, op, value = f
+        if not isinstance(name, basestring):
+            raise InvalidQuery('Filter property must be a string.')
+        op = OPERATOR_ALIASES.get(op, op)
+        if op not in OPERATORS:
+            raise InvalidQuery('Unknown operator: {!r}'.format(op))
+        if op == 'in' and not isinstance(value, list):
+            raise InvalidQuery('The value of an "in" filter must be a list.')
+        filters.append((name, op, value))
+    filters.sort(key=lambda f: (f[0], f[1]))
+
+    orders = query.get('order') or []
+    if isinstance(orders, basestring):
+        orders = [orders]
+    if not isinstance(orders, list) or \
+       not all(isinstance(o, basestring) for o in orders):
+        raise InvalidQuery('order must be a list of property names.')
+
+    limit = query.get('limit')
+    if limit is not None:
+        if not isinstance(limit, (int, long)) or limit < 1:
+            raise InvalidQuery('limit must be a positive integer.')
+
+    shape = (tuple((name, op) for name, op, value in filters), tuple(orders))
+    values = [value for name, op, value in filters]
+    return shape, values, limit
+
+
+class CompiledQuery(object):
+    """
+    A validated query shape bound to a model. ``build()`` applies values to
+    produce an ``ndb.Query``.
+    """
+
+    def __init__(self, model, shape):
+        self.model = model
+        filters, orders = shape
+        self._filters = [(self._get_property(name), OPERATORS[op])
+                         for name, op in filters]
+        self._orders = [self._get_order(o) for o in orders]
+        # Queries the datastore would reject are rejected here, so that the
+        # client gets a `400 Bad Request` rather than an error on fetch.
+        inequalities = sorted(set(
+            name for name, op in filters if op in INEQUALITY_OPERATORS))
+        if len(inequalities) > 1:
+            raise InvalidQuery(
+                'Inequality filters are only allowed on one property: '
+                '{}'.format(', '.join(inequalities)))
+        if inequalities:
+            name = inequalities[0]
+            if not orders:
+                self._orders.append(self._get_property(name))
+            elif orders[0].lstrip('-') != name:
+                raise InvalidQuery(
+                    'The first order must be on the property of the '
+                    'inequality filter: {}'.format(name))
+        # ``in`` and ``!=`` filters are run as several queries whose results
+        # are merged. Paging through them with cursors requires a key order.
+        if any(op in ('in', '!=') for name, op in filters):
+            self._orders.append(self.model.key)
+
+    def _get_property(self, name):
+        prop = self.model._properties.get(name)
+        if prop is None:
+            raise InvalidQuery('Unknown property: {}'.format(name))
+        if not prop._indexed:
+            raise InvalidQuery('Property is not indexed: {}'.format(name))
+        return prop
+
+    def _get_order(self, order):
+        if order.startswith('-'):
+            return -self._get_property(order[1:])
+        return self._get_property(order)
+
+    def build(self, values):
+        """
+        Returns an ``ndb.Query`` with ``values`` applied to the filters.
+        """
+        q = self.model.query()
+        for (prop, op), value in zip(self._filters, values):
+            q = q.filter(op(prop, value))
+        if self._orders:
+            q = q.order(*self._orders)
+        return q
+
+
+class QueryCompiler(object):
+    """
+    Compiles JSON queries for a model and caches the ``CompiledQuery`` by the
+    query shape, so repeated queries skip validation.
+    """
+
+    def __init__(self, model, max_size=100):
+        self.model = model
+        self.max_size = max_size
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def compile(self, query):
+        """
+        Returns a tuple of ``(ndb.Query, limit)`` for a JSON ``query``.
+        """
+        shape, values, limit = parse_query(query)
+        compiled = self._cache.get(shape)
+        if compiled is None:
+            compiled = CompiledQuery(self.model, shape)
+            with self._lock:
+                if len(self._cache) >= self.max_size:
+                    self._cache.clear()
+                self._cache[shape] = compiled
+        try:
+            return compiled.build(values), limit
+        except (TypeError, datastore_errors.BadValueError), e:
+            raise InvalidQuery(str(e))
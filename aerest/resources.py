@@ -11,13 +11,33 @@
 
 """
 
+import hashlib
 import json
+import sys
 import webapp2
+from google.appengine.api import datastore_errors
 from google.appengine.ext import ndb
+from webob import exc
 
 from aerest.authentication import Authentication
 from aerest.authorization import AdminAuthorization
 from aerest.authorization import ReadAuthorization
+from aerest.batch import BatchError
+from aerest.batch import map_chunks_async
+from aerest.cache import EntityCache
+from aerest.cache import IdentityMap
+from aerest.cache import serialize_entity
+from aerest.idpool import IdPool
+from aerest.instrumentation import Instrumentation
+from aerest.instrumentation import NULL_PHASE
+from aerest.profiling import MemcacheProfileStore
+from aerest.profiling import Profile
+from aerest.query import InvalidQuery
+from aerest.query import QueryCompiler
+from aerest.streaming import EntityStream
+from aerest.streaming import decode_lines
+from aerest.streaming import encode_collection
+from aerest.utils import merge_patch
 
 
 class NDBResource(webapp2.RequestHandler):
@@ -28,6 +48,64 @@ class NDBResource(webapp2.RequestHandler):
     resource_name = None
     resource_name_plural = None
     id_type = long
+    # Number of entities returned by ``find_many`` when no ``limit`` is given.
+    default_limit = 100
+    # Upper bound for the ``limit`` a client may request.
+    max_limit = 1000
+    # Encode collection responses one entity at a time instead of building
+    # the whole document in memory.
+    stream_responses = False
+    # Number of entities fetched per datastore batch when streaming.
+    stream_batch_size = 50
+    # Send an ETag with single entity responses and answer conditional
+    # requests with `304 Not Modified`.
+    use_etags = True
+    # Cache the serialized entities read by ``find`` in memcache for
+    # ``cache_ttl`` seconds. Writes through the resource refresh the cache.
+    # Entities read from the cache only have their ``data`` property set.
+    cache_entities = False
+    cache_ttl = 60
+    # Run handlers inside ``ndb.toplevel``, which waits for every future a
+    # handler started before the response is sent. The helpers then leave
+    # the writes the response does not depend on, the cache refreshes and
+    # the refills of the id pool, running while the response is rendered.
+    # Handlers of subclasses may also start several ``*_async`` helpers and
+    # wait for them together.
+    use_async = False
+    # Number of ids reserved at a time for new entities, see
+    # ``aerest.idpool.IdPool``.
+    id_pool_size = 100
+    # Maximum number of keys sent to the datastore in a single batch call,
+    # and the number of such calls kept in flight at once.
+    batch_size = 500
+    batch_concurrency = 4
+    # Maximum number of entities written by a single export request, and the
+    # batch and prefetch sizes of the export query.
+    export_limit = 10000
+    export_batch_size = 500
+    export_prefetch_size = None
+    # Record the duration of each phase of a request, the API calls made and
+    # the payload sizes, see ``aerest.instrumentation``. They are sent in a
+    # `Server-Timing` header and passed to ``instrumentation_sink``, an
+    # ``InstrumentationSink`` class, if set.
+    instrument = False
+    instrumentation_sink = None
+    # Let users allowed by ``profile_authorization`` profile a request by
+    # sending the ``profile_header``, see ``_dispatch_profiled``. The
+    # ``profile_limit`` functions with the highest ``profile_sort`` key are
+    # kept.
+    profiling = False
+    profile_header = 'X-Aerest-Profile'
+    profile_authorization = AdminAuthorization
+    profile_limit = 30
+    profile_sort = 'cumulative'
+    profile_store = MemcacheProfileStore
+    # Keep a version counter in the ``version_key`` member of the data of
+    # entities. Updates are made in a transaction and, when the client sends
+    # the version it read, either in the ``If-Match`` header or in the data,
+    # fail with `412 Precondition Failed` if the entity has changed since.
+    versioned = False
+    version_key = 'version'
 
     @property
     def _resource_model(self):
@@ -60,21 +138,164 @@ class NDBResource(webapp2.RequestHandler):
         """
         return self.id_type
 
+    @classmethod
+    def _get_query_compiler(cls):
+        """
+        Returns the ``QueryCompiler`` of this resource. It is shared by all
+        requests so that compiled queries are cached across requests.
+        """
+        compiler = cls.__dict__.get('_query_compiler')
+        if compiler is None:
+            compiler = QueryCompiler(cls.resource_model)
+            cls._query_compiler = compiler
+        return compiler
+
+    @classmethod
+    def _get_id_pool(cls):
+        """
+        Returns the ``IdPool`` of this resource. It is shared by all requests
+        so that ids are reserved in ranges.
+        """
+        pool = cls.__dict__.get('_id_pool')
+        if pool is None:
+            pool = IdPool(cls.resource_model, cls.id_pool_size)
+            cls._id_pool = pool
+        return pool
+
+    @property
+    def _entity_cache(self):
+        """
+        Returns the ``EntityCache`` for ``resource_model`` or ``None`` if
+        ``cache_entities`` is not set.
+        """
+        if not self.cache_entities:
+            return None
+        return EntityCache(self._resource_model._get_kind(), self.cache_ttl)
+
     def _generate_key(self, id):
         return ndb.Key(self._resource_model, self._id_type(id))
 
     def dispatch(self):
-        # Check if the user is authenticated.
-        self.is_authenticated()
-        # Check if the user is authorized.
-#        self.is_authorized()
+        if self.profiling and self.profile_header in self.request.headers \
+                and self._may_profile():
+            return self._dispatch_profiled()
+        return self._dispatch()
+
+    def _dispatch(self):
+        if self.instrument:
+            return self._dispatch_instrumented()
+        self.check_request()
         try:
-            # Dispatch the request.
-            webapp2.RequestHandler.dispatch(self)
+            self._dispatch_handler()
         finally:
             # Save all sessions.
             pass
 
+    def _dispatch_handler(self):
+        # Dispatch the request. Operations of a batch request share the
+        # ndb context of the batch.
+        if self.use_async and not hasattr(self.request, 'aerest_batch'):
+            ndb.toplevel(webapp2.RequestHandler.dispatch)(self)
+        else:
+            webapp2.RequestHandler.dispatch(self)
+
+    def _may_profile(self):
+        """
+        Returns ``True`` if ``profile_authorization`` allows the request to
+        be profiled.
+        """
+        try:
+            return self.profile_authorization().is_authorized(
+                self.request) is True
+        except Exception:
+            return False
+
+    def _dispatch_profiled(self):
+        """
+        Dispatches the request under ``cProfile``. If the profiling header is
+        ``inline`` the stats are returned as the response body. Otherwise,
+        or if the request failed, they are saved in ``profile_store`` and
+        the id to get them with is sent in the ``X-Aerest-Profile-Id``
+        header of HTTP responses.
+        """
+        profile = Profile(self.profile_limit, self.profile_sort)
+        inline = self.request.headers[self.profile_header] == 'inline'
+        try:
+            result = profile.runcall(self._dispatch)
+        except Exception, e:
+            exc_info = sys.exc_info()
+            id = self.profile_store().save(
+                self.request, profile.format_stats())
+            if isinstance(e, exc.HTTPException):
+                e.headers['X-Aerest-Profile-Id'] = id
+            raise exc_info[0], exc_info[1], exc_info[2]
+        stats = profile.format_stats()
+        if inline:
+            self.response.clear()
+            self.response.headers['Content-Type'] = \
+                'text/plain; charset=utf-8'
+            self.response.out.write(stats)
+        else:
+            self.response.headers['X-Aerest-Profile-Id'] = \
+                self.profile_store().save(self.request, stats)
+        return result
+
+    def _dispatch_instrumented(self):
+        """
+        Dispatches the request like ``dispatch``, recording the time spent in
+        authentication, authorization and the handler.
+        """
+        instrumentation = Instrumentation()
+        self.instrumentation = instrumentation
+        instrumentation.request_bytes = self.request.content_length or 0
+        try:
+            with instrumentation:
+                self.check_request()
+                with instrumentation.phase('handler'):
+                    self._dispatch_handler()
+        except exc.HTTPException, e:
+            instrumentation.status = e.code
+            raise
+        except Exception:
+            instrumentation.status = 500
+            raise
+        else:
+            instrumentation.status = self.response.status_int
+            instrumentation.response_bytes = len(self.response.body)
+            self.response.headers['Server-Timing'] = \
+                instrumentation.server_timing()
+        finally:
+            if self.instrumentation_sink is not None:
+                self.instrumentation_sink().emit(
+                    self.request, instrumentation.to_dict())
+
+    def _phase(self, name):
+        """
+        Returns a context manager that records the time spent in the phase
+        ``name`` if the request is instrumented.
+        """
+        instrumentation = self.__dict__.get('instrumentation')
+        if instrumentation is None:
+            return NULL_PHASE
+        return instrumentation.phase(name)
+
+    def check_request(self):
+        """
+        Checks the request before the handler is dispatched. The checks are
+        made once, a ``aerest.api.BatchHandler`` makes them before it reads
+        the entities of an operation.
+        """
+        if self.__dict__.get('_request_checked'):
+            return
+        # Check if the user is authenticated.
+        with self._phase('authn'):
+            self.is_authenticated()
+        # Check if the user is authorized. Only row-level checks that need
+        # the entity are left for the handler.
+        with self._phase('authz'):
+            self.is_authorized_request()
+        self._request_checked = True
+
     def is_authenticated(self):
         """
         Handles checking if the user is authenticated and dealing with
@@ -88,6 +309,48 @@ class NDBResource(webapp2.RequestHandler):
         if not auth_result is True:
             self.abort(401)
 
+    @property
+    def _authorizers(self):
+        """
+        Returns instances of the ``authorization`` classes. They are created
+        once per request and reused for every check.
+        """
+        authorizers = self.__dict__.get('_authorizer_instances')
+        if authorizers is None:
+            authorizers = [auth() for auth in self.authorization]
+            self._authorizer_instances = authorizers
+        return authorizers
+
+    def is_authorized_request(self):
+        """
+        Checks the authorization backends that do not need an object, see
+        ``Authorization.needs_object``, before anything is read from the
+        datastore.
+
+        If one of them allows the request no further checks are made for this
+        request. If none allows it and there are no row-level backends the
+        request is denied. Otherwise only the row-level backends are asked
+        by ``is_authorized`` and ``is_authorized_many``.
+        """
+        row_level = []
+        auth_result = False
+
+        for auth in self._authorizers:
+            if auth.needs_object():
+                row_level.append(auth)
+                continue
+            auth_result = auth.is_authorized(self.request)
+            if auth_result is True: break
+
+        if auth_result is True or isinstance(auth_result, webapp2.Response):
+            self._request_authorized = True
+            return
+
+        if not row_level:
+            return self.abort(401)
+
+        self._authorizer_instances = row_level
+
     def is_authorized(self, object=None):
         """
         Handles checking of permissions to see if the user has authorization
@@ -95,10 +358,13 @@ class NDBResource(webapp2.RequestHandler):
         the authorization backend can apply additional row-level permissions
         checking.
         """
+        if self.__dict__.get('_request_authorized'):
+            return
+
         auth_result = False
 
-        for auth in self.authorization:
-            auth_result = auth().is_authorized(self.request, object)
+        for auth in self._authorizers:
+            auth_result = auth.is_authorized(self.request, object)
             if auth_result is True: break
 
         if isinstance(auth_result, webapp2.Response):
@@ -107,180 +373,837 @@ class NDBResource(webapp2.RequestHandler):
         if not auth_result is True:
             return self.abort(401)
 
+    def is_authorized_many(self, objects):
+        """
+        Same as ``is_authorized`` for a list of ``objects``. Each
+        authorization backend is asked once for all objects it has not yet
+        seen authorized, see ``Authorization.is_authorized_many``.
+        """
+        if self.__dict__.get('_request_authorized'):
+            return
+
+        pending = list(objects)
+        results = [False] * len(pending)
+
+        for auth in self._authorizers:
+            if not pending: break
+            results = auth.is_authorized_many(self.request, pending)
+            pending, results = self._unauthorized(pending, results)
+
+        for auth_result in results:
+            if not isinstance(auth_result, webapp2.Response):
+                return self.abort(401)
+
+    def _requires_objects(self):
+        """
+        Returns ``True`` if the authorization checks left for this request
+        need the entities, i.e. they have to be read before a write.
+        """
+        if self.__dict__.get('_request_authorized'):
+            return False
+        return any(auth.needs_object() for auth in self._authorizers)
+
+    def _unauthorized(self, objects, results):
+        """
+        Returns the ``objects`` and ``results`` for which the result was not
+        ``True``.
+        """
+        pending = []
+        pending_results = []
+        for o, r in zip(objects, results):
+            if r is not True:
+                pending.append(o)
+                pending_results.append(r)
+        return pending, pending_results
+
     @classmethod
     def get_routes(cls):
         resource_name_plural = cls.resource_name_plural
         if resource_name_plural is None:
             resource_name_plural = "{}s".format(cls.resource_name)
+        return cls.build_routes(cls, resource_name_plural)
+
+    @staticmethod
+    def get_allowed_methods(application):
+        """
+        Returns the ``allowed_methods`` of ``application`` with the methods
+        of the resource routes that webapp2 does not allow by default::
+
+            app = webapp2.WSGIApplication(routes)
+            app.allowed_methods = NDBResource.get_allowed_methods(app)
+        """
+        return application.allowed_methods.union(['PATCH'])
+
+    @staticmethod
+    def build_routes(handler, resource_name_plural):
+        """
+        Returns the routes of a resource. ``handler`` is the resource class
+        or its dotted import path, which webapp2 imports on the first
+        request.
+
+        The routes include ``PATCH`` routes, which webapp2 answers with
+        `501 Not Implemented` unless the method is added to the
+        ``allowed_methods`` of the application, see ``get_allowed_methods``.
+        """
         return [
-            webapp2.Route(r'/{}'.format(resource_name_plural), handler=cls, handler_method='find_many', methods=['GET']),
-            webapp2.Route(r'/{}'.format(resource_name_plural), handler=cls, handler_method='create', methods=['POST']),
-            webapp2.Route(r'/{}'.format(resource_name_plural), handler=cls, handler_method='update_many', methods=['PUT']),
-            webapp2.Route(r'/{}'.format(resource_name_plural), handler=cls, handler_method='delete_many', methods=['DELETE']),
-            webapp2.Route(r'/{}/<id>'.format(resource_name_plural), handler=cls, handler_method='find', methods=['GET']),
-            webapp2.Route(r'/{}/<id>'.format(resource_name_plural), handler=cls, handler_method='update', methods=['PUT']),
-            webapp2.Route(r'/{}/<id>'.format(resource_name_plural), handler=cls, handler_method='delete', methods=['DELETE']),
+            webapp2.Route(r'/{}'.format(resource_name_plural), handler=handler, handler_method='find_many', methods=['GET']),
+            webapp2.Route(r'/{}'.format(resource_name_plural), handler=handler, handler_method='create', methods=['POST']),
+            webapp2.Route(r'/{}'.format(resource_name_plural), handler=handler, handler_method='update_many', methods=['PUT']),
+            webapp2.Route(r'/{}'.format(resource_name_plural), handler=handler, handler_method='patch_many', methods=['PATCH']),
+            webapp2.Route(r'/{}'.format(resource_name_plural), handler=handler, handler_method='delete_many', methods=['DELETE']),
+            webapp2.Route(r'/{}/_import'.format(resource_name_plural), handler=handler, handler_method='bulk_import', methods=['POST']),
+            webapp2.Route(r'/{}/_export'.format(resource_name_plural), handler=handler, handler_method='bulk_export', methods=['GET']),
+            webapp2.Route(r'/{}/<id>'.format(resource_name_plural), handler=handler, handler_method='find', methods=['GET']),
+            webapp2.Route(r'/{}/<id>'.format(resource_name_plural), handler=handler, handler_method='update', methods=['PUT']),
+            webapp2.Route(r'/{}/<id>'.format(resource_name_plural), handler=handler, handler_method='patch', methods=['PATCH']),
+            webapp2.Route(r'/{}/<id>'.format(resource_name_plural), handler=handler, handler_method='delete', methods=['DELETE']),
             ]
 
+    def _get_page_params(self, default_limit=None, max_limit=None):
+        """
+        Returns the ``limit`` and ``cursor`` given in the query string. The
+        ``limit`` defaults to ``default_limit`` and is capped at
+        ``max_limit``, which default to the attributes of the same name.
+        """
+        if default_limit is None:
+            default_limit = self.default_limit
+        if max_limit is None:
+            max_limit = self.max_limit
+        try:
+            limit = int(self.request.get('limit', default_limit))
+        except ValueError:
+            return self.abort(400)
+        if limit < 1:
+            return self.abort(400)
+        limit = min(limit, max_limit)
+
+        cursor = self.request.get('cursor') or None
+        if cursor is not None:
+            try:
+                cursor = ndb.Cursor(urlsafe=cursor)
+            except datastore_errors.BadValueError:
+                return self.abort(400)
+        return limit, cursor
+
+    def _next_cursor(self, next_cursor, more):
+        """
+        Returns the opaque cursor a client may pass back to get the next page
+        or ``None`` if this was the last page.
+        """
+        if more and next_cursor is not None:
+            return next_cursor.urlsafe()
+        return None
+
     def render_json(self, data):
         self.response.headers.add_header(
             'content-type', 'application/json', charset='utf-8')
-        self.response.out.write(json.dumps(data))
+        with self._phase('render'):
+            self.response.out.write(json.dumps(data))
 
-    def _find_entity(self, id):
-        e = self._resource_model.get_by_id(self._id_type(id))
+    def _generate_etag(self, body):
+        """
+        Returns a strong ETag for a serialized response ``body``.
+        """
+        return hashlib.md5(body).hexdigest()
+
+    def render_json_conditional(self, body, etag=None):
+        """
+        Renders an already serialized JSON ``body`` with an ETag, ``etag`` or
+        one generated from the body. If the request has a matching
+        ``If-None-Match`` header the body is omitted and `304 Not Modified`
+        is returned instead.
+        """
+        if self.use_etags:
+            if etag is None:
+                etag = self._generate_etag(body)
+            self.response.etag = etag
+            if etag in self.request.if_none_match:
+                self.response.status = 304
+                return
+        self.response.headers.add_header(
+            'content-type', 'application/json', charset='utf-8')
+        self.response.out.write(body)
+
+    def _entity_etag(self, e):
+        """
+        Returns the version of a versioned entity ``e`` as its ETag, so that
+        it may be sent back in an ``If-Match`` header, or ``None``.
+        """
+        if self.versioned and e.data.get(self.version_key) is not None:
+            return str(e.data[self.version_key])
+        return None
+
+    def render_json_stream(self, name, entities, extra=None):
+        """
+        Writes ``{name: [e.data for e in entities]}`` to the response one
+        entity at a time. See ``aerest.streaming.encode_collection``.
+        """
+        self.response.headers.add_header(
+            'content-type', 'application/json', charset='utf-8')
+        out = self.response.out
+        with self._phase('render'):
+            for chunk in encode_collection(name, entities, extra):
+                out.write(chunk)
+
+    def render_batch_error(self, error, name=None):
+        """
+        Renders a partially failed batch with `207 Multi-Status`. The results
+        of the items that succeeded are keyed by ``name``, entities by
+        ``resource_name_plural``, next to a list of the errors.
+        """
+        self.response.status = 207
+        if name is None:
+            results = [e.data for e in error.results]
+            name = self._resource_name_plural
+        else:
+            results = error.results
+        return self.render_json({name: results, 'errors': error.to_list()})
+
+    def render_entities(self, entities, extra=None):
+        """
+        Renders a list of entities keyed by ``resource_name_plural``.
+        ``extra`` is an optional dictionary of additional members.
+        """
+        if self.stream_responses:
+            return self.render_json_stream(
+                self._resource_name_plural, entities,
+                extra and (lambda: extra))
+        data = {self._resource_name_plural: [e.data for e in entities]}
+        if extra:
+            data.update(extra)
+        return self.render_json(data)
+
+    @property
+    def identity_map(self):
+        """
+        Returns the ``IdentityMap`` of the entities read during this request.
+        """
+        identity_map = self.__dict__.get('_identity_map')
+        if identity_map is None:
+            identity_map = IdentityMap()
+            self._identity_map = identity_map
+        return identity_map
+
+    @ndb.tasklet
+    def _get_multi_async(self, keys):
+        """
+        Returns the entities for ``keys``. Keys that were already read during
+        this request are taken from the ``identity_map``, the others are read
+        in chunks of ``batch_size``. The first failure is raised.
+        """
+        identity_map = self.identity_map
+        missing = identity_map.missing(keys)
+        if missing:
+            entities, errors = yield map_chunks_async(
+                ndb.get_multi_async, missing, self.batch_size,
+                self.batch_concurrency)
+            if errors:
+                raise errors[min(errors)]
+            identity_map.add(missing, entities)
+        raise ndb.Return([identity_map[k] for k in keys])
+
+    @ndb.tasklet
+    def _get_async(self, key):
+        """
+        Same as ``_get_multi_async`` for a single key.
+        """
+        entities = yield self._get_multi_async([key])
+        raise ndb.Return(entities[0])
+
+    @ndb.tasklet
+    def _write_multi_async(self, func, items):
+        """
+        Calls ``func``, e.g. ``ndb.put_multi_async``, for chunks of ``items``.
+        Returns a tuple of ``(results, errors)``, see
+        ``aerest.batch.map_chunks_async``.
+        """
+        results, errors = yield map_chunks_async(
+            func, items, self.batch_size, self.batch_concurrency)
+        raise ndb.Return((results, errors))
+
+    def _succeeded(self, items, errors):
+        return [item for i, item in enumerate(items) if i not in errors]
+
+    @property
+    def unchanged_ids(self):
+        """
+        Returns the ids of the entities that an update left as they were, and
+        so were not written, during this request.
+        """
+        unchanged_ids = self.__dict__.get('_unchanged_ids')
+        if unchanged_ids is None:
+            unchanged_ids = []
+            self._unchanged_ids = unchanged_ids
+        return unchanged_ids
+
+    def _set_data(self, e, data):
+        """
+        Sets the ``data`` of ``e``. Returns ``False``, and records the id in
+        ``unchanged_ids``, if ``data`` equals what is stored.
+        """
+        if e.data == data:
+            self.unchanged_ids.append(e.key.id())
+            return False
+        e.data = data
+        return True
+
+    @ndb.tasklet
+    def _put_entity_async(self, e):
+        """
+        Writes a single entity and refreshes the cache.
+        """
+        self.identity_map.add([e.key], [e])
+        yield e.put_async()
+        if self._entity_cache is not None:
+            yield self._background_async(self._entity_cache.set_async([e]))
+
+    @ndb.tasklet
+    def _put_entities_async(self, entities, refresh_cache=True):
+        """
+        Writes ``entities`` in chunks and refreshes the cache for the ones
+        that were written. Raises ``BatchError`` if some of them failed.
+        """
+        self.identity_map.add([e.key for e in entities], entities)
+        results, errors = yield self._write_multi_async(
+            ndb.put_multi_async, entities)
+        succeeded = self._succeeded(entities, errors)
+        if refresh_cache and self._entity_cache is not None:
+            yield self._background_async(
+                self._entity_cache.set_async(succeeded))
+        if errors:
+            raise BatchError(succeeded, errors)
+
+    @ndb.tasklet
+    def _delete_keys_async(self, keys):
+        """
+        Deletes ``keys`` in chunks and removes them from the cache. Raises
+        ``BatchError`` with the ids that were deleted if some of them failed.
+        """
+        self.identity_map.remove(keys)
+        results, errors = yield self._write_multi_async(
+            ndb.delete_multi_async, keys)
+        if self._entity_cache is not None:
+            yield self._background_async(
+                self._entity_cache.delete_async([k.id() for k in keys]))
+        if errors:
+            raise BatchError(
+                [k.id() for k in self._succeeded(keys, errors)], errors)
+
+    def _background_async(self, future):
+        """
+        Returns a future to wait on for ``future``, a write the response
+        does not depend on. With ``use_async`` the handler is run inside
+        ``ndb.toplevel``, which waits for ``future`` before the response is
+        sent, so a future that is already done is returned.
+        """
+        if not self.use_async or hasattr(self.request, 'aerest_batch'):
+            return future
+        done = ndb.Future()
+        done.set_result(None)
+        return done
+
+    def _commit_async(self, future):
+        """
+        Returns ``future``, the writes of a helper. When the request is an
+        operation of a batch request, see ``aerest.api.BatchHandler``, the
+        future is handed to the batch instead, so that its writes are sent
+        together with the writes of the other operations.
+        """
+        batch = getattr(self.request, 'aerest_batch', None)
+        if batch is None:
+            return future
+        batch.defer(future)
+        done = ndb.Future()
+        done.set_result(None)
+        return done
+
+    @ndb.tasklet
+    def _find_entity_async(self, id):
+        key = self._generate_key(id)
+        cache = self._entity_cache
+        e = None
+        if cache is not None and key not in self.identity_map:
+            body = yield cache.get_async(key.id())
+            if body is not None:
+                e = self._resource_model(key=key, data=json.loads(body))
+                # Keep the serialized copy so that it is not encoded again.
+                e._serialized = body
+                self.identity_map.add([key], [e])
+        if e is None:
+            e = yield self._get_async(key)
+            if cache is not None and e is not None:
+                yield self._background_async(cache.add_async([e]))
 
         # Check authorization
         self.is_authorized(e)
 
-        return e
+        raise ndb.Return(e)
 
-    def _find_entities(self, ids):
+    def _find_entity(self, id):
+        return self._find_entity_async(id).get_result()
+
+    @ndb.tasklet
+    def _find_entities_async(self, ids):
         assert isinstance(ids, list), 'ids must be a list.'
         keys = [self._generate_key(i) for i in ids]
-        entities = ndb.get_multi(keys)
+        entities = yield self._get_multi_async(keys)
 
         # Check authorization
-        for e in entities:
-            self.is_authorized(e)
+        self.is_authorized_many(entities)
+
+        raise ndb.Return(entities)
+    find_entities_async = _find_entities_async
 
-        return entities
+    def _find_entities(self, ids):
+        return self.find_entities_async(ids).get_result()
     find_entities = _find_entities
 
-    def _find_entities_query(self, query):
-        # TODO: implement
-        raise NotImplementedError
-    find_entities_query = _find_entities_query
+    def _compile_query(self, query, limit=None):
+        """
+        Returns a tuple of ``(ndb.Query, limit)`` for a JSON ``query``. A
+        ``limit`` given in the query takes precedence.
+        """
+        try:
+            q, query_limit = self._get_query_compiler().compile(query)
+        except InvalidQuery, e:
+            return self.abort(400, detail=str(e))
+        if query_limit is not None:
+            limit = min(query_limit, self.max_limit)
+        if limit is None:
+            limit = self.default_limit
+        return self._authorize_query(q), limit
 
-    def _find_entities_all(self):
-        entities = self._resource_model.query().fetch(1000)
+    def _authorize_query(self, query):
+        """
+        Lets a row-level authorization backend narrow ``query`` to the
+        entities the user may see, see ``Authorization.filter_query``, so
+        that foreign entities are never read.
+
+        This is only done when a single row-level backend is left for the
+        request, as a filter would hide entities other backends may allow.
+        """
+        if not self._requires_objects():
+            return query
+        row_level = [auth for auth in self._authorizers
+                     if auth.needs_object()]
+        if len(row_level) != len(self._authorizers) or len(row_level) != 1:
+            return query
+        filtered = row_level[0].filter_query(self.request, query)
+        if filtered is None:
+            return query
+        return filtered
+
+    def _fetch_page(self, query, limit, cursor):
+        entities, next_cursor, more = query.fetch_page(
+            limit, start_cursor=cursor)
 
         # Check authorization
-        for e in entities:
-            self.is_authorized(e)
+        self.is_authorized_many(entities)
+
+        return entities, next_cursor, more
+
+    def _find_entities_query(self, query, limit=None, cursor=None):
+        """
+        Returns a page of entities matching a JSON ``query`` as a tuple of
+        ``(entities, next_cursor, more)``. See ``aerest.query`` for the
+        query format.
+        """
+        q, limit = self._compile_query(query, limit)
+        return self._fetch_page(q, limit, cursor)
+    find_entities_query = _find_entities_query
 
-        return entities
+    def _iter_entities_query(self, query, limit=None, cursor=None):
+        """
+        Returns an ``EntityStream`` over the entities matching a JSON
+        ``query``.
+        """
+        q, limit = self._compile_query(query, limit)
+        return EntityStream(q, limit, cursor, self.stream_batch_size,
+                            check=self.is_authorized)
+    iter_entities_query = _iter_entities_query
+
+    def _find_entities_all(self, limit=None, cursor=None):
+        """
+        Returns a page of entities as a tuple of ``(entities, next_cursor,
+        more)``, see ``ndb.Query.fetch_page``.
+        """
+        if limit is None:
+            limit = self.default_limit
+        q = self._authorize_query(self._resource_model.query())
+        return self._fetch_page(q, limit, cursor)
     find_entities_all = _find_entities_all
 
-    def _create_entity(self, data):
-        # allocate_ids so that we can append the id to the `data` prior to the
-        # datastore put.
-        first_id, last_id = self._resource_model.allocate_ids(1)
-        data['id'] = first_id
-        e = self._resource_model(id=first_id, data=data)
+    def _iter_entities_all(self, limit=None, cursor=None):
+        """
+        Returns an ``EntityStream`` over a page of entities.
+        """
+        if limit is None:
+            limit = self.default_limit
+        q = self._authorize_query(self._resource_model.query())
+        return EntityStream(q, limit, cursor,
+                            self.stream_batch_size, check=self.is_authorized)
+    iter_entities_all = _iter_entities_all
+
+    def _iter_entities_export(self, limit=None, cursor=None):
+        """
+        Returns an ``EntityStream`` over up to ``limit`` entities, by default
+        ``export_limit``, fetched with the ``export_*`` batch sizes.
+        """
+        if limit is None:
+            limit = self.export_limit
+        q = self._authorize_query(self._resource_model.query())
+        return EntityStream(q, limit, cursor, self.export_batch_size,
+                            check=self.is_authorized,
+                            prefetch_size=self.export_prefetch_size)
+    iter_entities_export = _iter_entities_export
+
+    @ndb.tasklet
+    def _create_entity_async(self, data):
+        if self.versioned:
+            data[self.version_key] = 1
+        # The id is taken from ids reserved in advance so that we can append
+        # it to the `data` prior to the datastore put. If the pool has to
+        # reserve more, the entity is authorized meanwhile.
+        pool = self._get_id_pool()
+        ids_future = pool.take_async(1)
+        e = self._resource_model(data=data)
 
         # Check authorization
         self.is_authorized(e)
 
-        e.put()
-        return e
+        ids = yield ids_future
+        data['id'] = ids[0]
+        e.key = ndb.Key(self._resource_model, ids[0])
+        self.identity_map.add([e.key], [e])
+        yield (self._commit_async(e.put_async()),
+               self._background_async(pool.refill_if_low_async()))
+        raise ndb.Return(e)
+    create_entity_async = _create_entity_async
+
+    def _create_entity(self, data):
+        return self.create_entity_async(data).get_result()
     create_entity = _create_entity
 
-    def _create_entities(self, data):
+    @ndb.tasklet
+    def _create_entities_async(self, data):
         assert isinstance(data, list),\
         "create_entities requires data to be a list."
-        # allocate_ids so that we can append the id to the `data` prior to the
-        # datastore put.
-        res_id, last_id = self._resource_model.allocate_ids(len(data))
-        entities = []
-        for v in data:
-            v['id'] = res_id
-            e = self._resource_model(id=res_id, data=v)
-
-            # Check authorization
-            self.is_authorized(e)
+        if self.versioned:
+            for v in data:
+                v[self.version_key] = 1
+        # The ids are taken from ids reserved in advance so that we can append
+        # them to the `data` prior to the datastore put. If the pool has to
+        # reserve more, the entities are authorized meanwhile.
+        pool = self._get_id_pool()
+        ids_future = pool.take_async(len(data))
+        entities = [self._resource_model(data=v) for v in data]
+
+        # Check authorization
+        self.is_authorized_many(entities)
+
+        ids = yield ids_future
+        for id, e in zip(ids, entities):
+            e.data['id'] = id
+            e.key = ndb.Key(self._resource_model, id)
+        yield (self._commit_async(self._put_entities_async(entities, False)),
+               self._background_async(pool.refill_if_low_async()))
+        raise ndb.Return(entities)
+    create_entities_async = _create_entities_async
 
-            entities.append(e)
-            res_id += 1
-        ndb.put_multi(entities)
-        return entities
+    def _create_entities(self, data):
+        return self.create_entities_async(data).get_result()
     create_entities = _create_entities
 
-    def _update_entity(self, id, data):
-        e = self._resource_model.get_by_id(int(id))
+    @ndb.tasklet
+    def _import_entities_async(self, lines):
+        """
+        Creates an entity for each ``(line_number, data)`` tuple of
+        ``lines``. The ids are allocated as a single range.
+
+        Returns a tuple of ``(count, errors)``, the number of entities
+        written and a list of ``{'line': n, 'error': message}`` dictionaries
+        for the lines that failed.
+        """
+        # The ids are allocated while the entities are authorized.
+        ids_future = self._resource_model.allocate_ids_async(len(lines))
+        entities = [self._resource_model(data=data) for n, data in lines]
+
+        # Check authorization
+        self.is_authorized_many(entities)
+
+        first, last = yield ids_future
+        for id, e in zip(xrange(first, last + 1), entities):
+            e.data['id'] = id
+            if self.versioned:
+                e.data[self.version_key] = 1
+            e.key = ndb.Key(self._resource_model, id)
+        results, errors = yield self._write_multi_async(
+            ndb.put_multi_async, entities)
+        raise ndb.Return((
+            len(entities) - len(errors),
+            [{'line': lines[i][0], 'error': str(errors[i])}
+             for i in sorted(errors)]))
+    import_entities_async = _import_entities_async
+
+    @ndb.tasklet
+    def _update_entity_async(self, id, data):
+        if self.versioned:
+            e = yield self._change_entity_async(
+                id, lambda old: data, self._expected_version(data, True))
+            raise ndb.Return(e)
+
+        e = yield self._get_async(self._generate_key(id))
         if e is None:
-            return None
+            raise ndb.Return(None)
 
         # Check authorization
         self.is_authorized(e)
 
-        e.data = data
-        e.put()
-        return e
+        if self._set_data(e, data):
+            yield self._commit_async(self._put_entity_async(e))
+        raise ndb.Return(e)
+    update_entity_async = _update_entity_async
+
+    def _update_entity(self, id, data):
+        return self.update_entity_async(id, data).get_result()
     update_entity = _update_entity
 
-    def _update_entities(self, data):
+    @ndb.tasklet
+    def _update_entities_async(self, data):
+        if self.versioned:
+            entities = yield self._change_entities_async(
+                data, lambda old, d: d)
+            raise ndb.Return(entities)
+
         ids = [d['id'] for d in data]
-        entities = self.find_entities(ids)
-        updated_entities = []
-        for i, e in enumerate(entities):
+        # find_entities checks authorization.
+        entities = yield self.find_entities_async(ids)
 
-            # Check authorization
-            self.is_authorized(e)
+        # Unchanged entities are returned but not written.
+        changed = [e for i, e in enumerate(entities)
+                   if self._set_data(e, data[i])]
+        if changed:
+            yield self._commit_async(self._put_entities_async(changed))
+        raise ndb.Return(entities)
+    update_entities_async = _update_entities_async
 
-            e.data = data[i]
-            updated_entities.append(e)
-        ndb.put_multi(updated_entities)
-        return updated_entities
+    def _update_entities(self, data):
+        return self.update_entities_async(data).get_result()
     update_entities = _update_entities
 
-    def _delete_entity(self, id):
+    def _expected_version(self, data, if_match=False):
+        """
+        Returns the version a write of ``data`` expects to replace, or
+        ``None`` if any version may be replaced. If ``if_match`` is set the
+        ``If-Match`` header of the request takes precedence over the
+        ``version_key`` member of ``data``.
+        """
+        if not self.versioned:
+            return None
+        if if_match:
+            header = self.request.headers.get('If-Match', '').strip()
+            if header == '*':
+                return None
+            if header:
+                if header.startswith('W/'):
+                    header = header[2:]
+                try:
+                    return int(header.strip('"'))
+                except ValueError:
+                    return self.abort(412)
+        return data.get(self.version_key)
+
+    @ndb.tasklet
+    def _change_entity_async(self, id, change, version=None):
+        """
+        Replaces the data of the entity with ``id`` with ``change(data)`` in
+        a transaction. Returns ``None`` if there is no entity with ``id``.
+
+        If ``version`` is given and is not the stored version the request is
+        aborted with `412 Precondition Failed`. Versioned entities get a new
+        version when their data changes.
+
+        The transaction is committed right away, also when the request is an
+        operation of a batch request.
+        """
+        key = self._generate_key(id)
+
+        @ndb.tasklet
+        def txn():
+            e = yield key.get_async()
+            if e is None:
+                raise ndb.Return(None, False)
+            self.is_authorized(e)
+            current = e.data.get(self.version_key) if self.versioned \
+                else None
+            if version is not None and version != current:
+                self.abort(412)
+            data = change(e.data)
+            if self.versioned:
+                data = dict(data)
+                data[self.version_key] = current
+            if data == e.data:
+                raise ndb.Return(e, False)
+            if self.versioned:
+                data[self.version_key] = (current or 0) + 1
+            e.data = data
+            yield e.put_async()
+            raise ndb.Return(e, True)
+
+        e, changed = yield ndb.transaction_async(txn)
+        if e is None:
+            raise ndb.Return(None)
+        self.identity_map.add([key], [e])
+        if not changed:
+            self.unchanged_ids.append(e.key.id())
+        elif self._entity_cache is not None:
+            yield self._background_async(self._entity_cache.set_async([e]))
+        raise ndb.Return(e)
+
+    @ndb.tasklet
+    def _change_entities_async(self, items, change):
+        """
+        Calls ``_change_entity_async`` for the entity with the ``id`` of each
+        of ``items``, with ``change(data, item)``. The expected version is
+        taken from the items. Raises ``BatchError`` if some of them failed
+        or do not exist.
+        """
+        for item in items:
+            if not isinstance(item, dict) or 'id' not in item:
+                self.abort(400, detail=(
+                    'Each item must be a JSON object with an "id".'))
+
+        def change_batch(batch):
+            return [self._change_entity_async(
+                        item['id'], lambda old, item=item: change(old, item),
+                        self._expected_version(item))
+                    for item in batch]
+
+        results, errors = yield self._write_multi_async(change_batch, items)
+        for i, e in enumerate(results):
+            if e is None and i not in errors:
+                errors[i] = LookupError(
+                    'Entity not found: {}'.format(items[i]['id']))
+        if errors:
+            raise BatchError(self._succeeded(results, errors), errors)
+        raise ndb.Return(results)
+
+    def _patch_entity_async(self, id, patch):
+        """
+        Applies the JSON Merge Patch (RFC 7386) ``patch`` to the data of the
+        entity with ``id`` in a transaction. Returns ``None`` if there is no
+        entity with ``id``.
+        """
+        return self._change_entity_async(
+            id, lambda old: merge_patch(old, patch),
+            self._expected_version(patch, True))
+    patch_entity_async = _patch_entity_async
+
+    def _patch_entity(self, id, patch):
+        return self.patch_entity_async(id, patch).get_result()
+    patch_entity = _patch_entity
+
+    def _patch_entities_async(self, patches):
+        """
+        Applies each patch of ``patches`` to the entity with the patch's
+        ``id``, each in its own transaction. Raises ``BatchError`` if some of
+        them failed or do not exist.
+        """
+        return self._change_entities_async(patches, merge_patch)
+    patch_entities_async = _patch_entities_async
+
+    def _patch_entities(self, patches):
+        return self.patch_entities_async(patches).get_result()
+    patch_entities = _patch_entities
+
+    @ndb.tasklet
+    def _delete_entity_async(self, id):
+        key = self._generate_key(id)
 
         # Check authorization
-        e = self._generate_key(id).get()
-        self.is_authorized(e)
+        if self._requires_objects():
+            e = yield self._get_async(key)
+            self.is_authorized(e)
+        else:
+            self.is_authorized()
+
+        yield self._commit_async(self._delete_keys_async([key]))
+        raise ndb.Return(None)
+    delete_entity_async = _delete_entity_async
 
-        return self._generate_key(id).delete()
+    def _delete_entity(self, id):
+        return self.delete_entity_async(id).get_result()
     delete_entity = _delete_entity
 
-    def _delete_entities(self, ids):
+    @ndb.tasklet
+    def _delete_entities_async(self, ids):
         keys = [self._generate_key(id) for id in ids]
 
-        # TODO: maybe there is a better way to accomplish this.
-        # For certain authorization strategies it is necessary to retrieve
-        # the entity to verify that the user is authorized to delete the
-        # record.
-        entities = ndb.get_multi(keys)
-        for e in entities:
-            # Check authorization
-            self.is_authorized(e)
+        # Check authorization
+        if self._requires_objects():
+            # For certain authorization strategies it is necessary to retrieve
+            # the entity to verify that the user is authorized to delete the
+            # record.
+            entities = yield self._get_multi_async(keys)
+            self.is_authorized_many(entities)
+        else:
+            self.is_authorized()
 
-        return ndb.delete_multi(keys)
+        yield self._commit_async(self._delete_keys_async(keys))
+        raise ndb.Return([None] * len(keys))
+    delete_entities_async = _delete_entities_async
+
+    def _delete_entities(self, ids):
+        return self.delete_entities_async(ids).get_result()
     delete_entities = _delete_entities
 
     # Handlers
     def _find(self, **kwargs):
         e = self._find_entity(kwargs['id'])
-        data = {}
         if e is None:
             self.abort(404)
-        # if the id is missing from the data, add it.
-        if not e.data.get('id'):
-            e.data['id'] = e.key.id()
-        data[self._resource_name] = e.data
-        return self.render_json(data)
+        with self._phase('render'):
+            body = getattr(e, '_serialized', None)
+            if body is None:
+                # if the id is missing from the data, add it.
+                body = serialize_entity(e)
+            return self.render_json_conditional(
+                '{{{}: {}}}'.format(json.dumps(self._resource_name), body),
+                self._entity_etag(e))
     find = _find
 
     def _find_many(self, **kwargs):
-        data = {}
-        if not self.request.body:
-            entities = self.find_entities_all()
-        else:
+        j = {}
+        if self.request.body:
             j = json.loads(self.request.body)
             # If we have a JSON body determine the type of query
-            try:
-                d = j['ids']
-                entities = self.find_entities(d)
-            except KeyError:
-                try:
-                    d = j['query']
-                    entities = self.find_entities_query(d)
-                except KeyError:
-                    # TODO: return an error message to users
-                    raise Exception(
-                        "JSON is not properly formed. Must be prefixed with "
-                        "'ids' or 'query'")
+            if 'ids' in j:
+                return self.render_entities(self.find_entities(j['ids']))
+            if 'query' not in j:
+                # TODO: return an error message to users
+                raise Exception(
+                    "JSON is not properly formed. Must be prefixed with "
+                    "'ids' or 'query'")
+
+        limit, cursor = self._get_page_params()
+        if self.stream_responses:
+            if 'query' in j:
+                stream = self.iter_entities_query(j['query'], limit, cursor)
+            else:
+                stream = self.iter_entities_all(limit, cursor)
+            return self.render_json_stream(
+                self._resource_name_plural, stream,
+                lambda: {'next': self._next_cursor(*stream.next_cursor())})
+
+        if 'query' in j:
+            entities, next_cursor, more = self.find_entities_query(
+                j['query'], limit, cursor)
+        else:
+            entities, next_cursor, more = self.find_entities_all(
+                limit, cursor)
+        data = {}
         data[self._resource_name_plural] = [e.data for e in entities]
+        data['next'] = self._next_cursor(next_cursor, more)
         return self.render_json(data)
     find_many = _find_many
 
@@ -295,52 +1218,157 @@ class NDBResource(webapp2.RequestHandler):
         except KeyError, e:
             try:
                 d = j[self._resource_name_plural]
-                e = self.create_entities(d)
-                data[self._resource_name_plural] = [i.data for i in e]
             except KeyError, e:
                 # TODO: return an error message to users
                 raise Exception(
                     "JSON is not properly formed. Must be prefixed with "
                     "'resource_name' or 'resource_name_plural'")
+            try:
+                e = self.create_entities(d)
+            except BatchError, e:
+                return self.render_batch_error(e)
+            return self.render_entities(e)
         return self.render_json(data)
     create = _create
 
-    def _update(self, **kwargs):
-        id = kwargs['id']
-        j = json.loads(self.request.body)
-        data = {}
+    def _bulk_import(self, **kwargs):
+        """
+        Creates an entity for each line of a newline-delimited JSON body.
+
+        The body is decoded a line at a time and written in chunks of
+        ``batch_size``, with up to ``batch_concurrency`` chunks in flight, so
+        only those chunks are held in memory. Responds with the number of
+        entities created and the lines that failed, with `207 Multi-Status`
+        if any did.
+        """
+        imported = 0
+        errors = []
+        in_flight = []
+        chunk = []
+
+        def collect(future):
+            count, failed = future.get_result()
+            errors.extend(failed)
+            return count
+
+        for n, data, error in decode_lines(self.request.body_file):
+            if error is None and not isinstance(data, dict):
+                error = ValueError('Each line must be a JSON object.')
+            if error is not None:
+                errors.append({'line': n, 'error': str(error)})
+                continue
+            chunk.append((n, data))
+            if len(chunk) >= self.batch_size:
+                in_flight.append(self.import_entities_async(chunk))
+                chunk = []
+                if len(in_flight) >= self.batch_concurrency:
+                    imported += collect(in_flight.pop(0))
+        if chunk:
+            in_flight.append(self.import_entities_async(chunk))
+        for future in in_flight:
+            imported += collect(future)
+
+        if errors:
+            self.response.status = 207
+        errors.sort(key=lambda error: error['line'])
+        return self.render_json({'imported': imported, 'errors': errors})
+    bulk_import = _bulk_import
+
+    def _bulk_export(self, **kwargs):
+        """
+        Writes up to ``export_limit`` entities as newline-delimited JSON, one
+        entity per line. If there may be more entities the cursor to resume
+        the export from is sent in the ``X-Next-Cursor`` header, so that an
+        export can be continued over several requests.
+        """
+        limit, cursor = self._get_page_params(
+            self.export_limit, self.export_limit)
+        stream = self.iter_entities_export(limit, cursor)
+        self.response.headers.add_header(
+            'content-type', 'application/x-ndjson', charset='utf-8')
+        out = self.response.out
+        # Only the encoding is timed as rendering, the entities are fetched
+        # by the stream between the writes.
+        for e in stream:
+            with self._phase('render'):
+                out.write(serialize_entity(e))
+                out.write('\n')
+        next_cursor = self._next_cursor(*stream.next_cursor())
+        if next_cursor is not None:
+            self.response.headers['X-Next-Cursor'] = next_cursor
+    bulk_export = _bulk_export
+
+    def _get_body_member(self, name):
+        """
+        Returns the member ``name`` of the JSON request body. Aborts with
+        `400 Bad Request` if the body is not an object with that member.
+        """
         try:
-            d = j[self._resource_name]
-        except KeyError, e:
-            # TODO: return an error message to users
-            raise Exception(
-                "JSON is not properly formed. Must be prefixed with "
-                "'resource_name' or 'resource_name_plural'")
-        e = self.update_entity(id, d)
+            return json.loads(self.request.body)[name]
+        except (ValueError, KeyError, TypeError):
+            return self.abort(400, detail=(
+                'The body must be a JSON object with a "{}" member.'
+                .format(name)))
+
+    def _render_changed(self, e):
+        """
+        Renders the entity ``e`` after an update or a patch.
+        """
         if e is None:
-            self.abort(404)
-        data[self._resource_name] = e.data
+            return self.abort(404)
+        data = {self._resource_name: e.data}
+        etag = self._entity_etag(e)
+        if etag is not None:
+            self.response.etag = etag
+        if self.unchanged_ids:
+            data['unchanged'] = self.unchanged_ids
         return self.render_json(data)
+
+    def _render_changed_many(self, entities):
+        """
+        Renders ``entities`` after an update or a patch of a collection.
+        """
+        extra = {}
+        if self.unchanged_ids:
+            extra['unchanged'] = self.unchanged_ids
+        return self.render_entities(entities, extra)
+
+    def _update(self, **kwargs):
+        d = self._get_body_member(self._resource_name)
+        return self._render_changed(self.update_entity(kwargs['id'], d))
     update = _update
 
     def _update_many(self, **kwargs):
-        j = json.loads(self.request.body)
-        data = {}
+        d = self._get_body_member(self._resource_name_plural)
         try:
-            d = j[self._resource_name_plural]
-        except KeyError, e:
-            # TODO: return an error message to users
-            raise Exception(
-                "JSON is not properly formed. Must be prefixed with "
-                "'resource_name' or 'resource_name_plural'")
-        e = self.update_entities(d)
+            e = self.update_entities(d)
+        except BatchError, e:
+            return self.render_batch_error(e)
         if e is None:
             return self.abort(code=404)
-        data[self._resource_name_plural] = [i.data for i in e]
-
-        return self.render_json(data)
+        return self._render_changed_many(e)
     update_many = _update_many
 
+    def _patch(self, **kwargs):
+        d = self._get_body_member(self._resource_name)
+        if not isinstance(d, dict):
+            return self.abort(400, detail='A patch must be a JSON object.')
+        return self._render_changed(self.patch_entity(kwargs['id'], d))
+    patch = _patch
+
+    def _patch_many(self, **kwargs):
+        d = self._get_body_member(self._resource_name_plural)
+        if not isinstance(d, list):
+            return self.abort(400, detail=(
+                '"{}" must be a list of patches.'.format(
+                    self._resource_name_plural)))
+        try:
+            e = self.patch_entities(d)
+        except BatchError, e:
+            return self.render_batch_error(e)
+        return self._render_changed_many(e)
+    patch_many = _patch_many
+
     def _delete(self, **kwargs):
         id = kwargs['id']
         deleted = self.delete_entity(id)
@@ -356,6 +1384,9 @@ class NDBResource(webapp2.RequestHandler):
             raise Exception(
                 "JSON is not properly formed. "
                 "JSON body must contain {'id': [] }")
-        e = self.delete_entities(ids)
+        try:
+            e = self.delete_entities(ids)
+        except BatchError, e:
+            return self.render_batch_error(e, 'ids')
         return self.render_json(e)
     delete_many = _delete_many
\ No newline at end of file
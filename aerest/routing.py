@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+"""
+    aerest.routing
+    ====================
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+import copy
+import re
+import urllib
+
+import webapp2
+from webob import exc
+
+
+_VARIABLE = re.compile(r'^<(\w+)>$')
+
+
+class _Node(object):
+
+    __slots__ = ('children', 'variable', 'routes')
+
+    def __init__(self):
+        # Maps a literal path segment to the next node.
+        self.children = {}
+        # A tuple of ``(name, node)`` for a ``<name>`` segment, or ``None``.
+        self.variable = None
+        # Maps a request method, or ``None`` for any method, to a route.
+        self.routes = {}
+
+
+class CompiledRoute(webapp2.BaseRoute):
+    """
+    Matches a list of ``webapp2.Route`` objects by walking a tree of their
+    path segments, so the cost of a match depends on the depth of the path
+    rather than the number of routes. It is added to a router as a single
+    route.
+
+    Templates may only be made of literal segments and ``<name>`` variables
+    that match a whole segment, like those of ``NDBResource.get_routes``.
+    Where a literal and a variable segment both match, the literal one is
+    tried first, so ``/people/_export`` is not taken for an id.
+
+    The ``template`` of the compiled route is a path prefix, so it may be
+    nested in a ``PathPrefixRoute``. The named routes are built by the
+    router, with the prefix, so ``uri_for`` works as without compiling.
+    """
+
+    def __init__(self, routes, template=''):
+        super(CompiledRoute, self).__init__(template)
+        self._root = _Node()
+        self._routes = []
+        for route in routes:
+            self.add(route)
+
+    def add(self, route):
+        self._routes.append(route)
+        if route.build_only:
+            # Only used to build URIs, see ``get_build_routes``.
+            return
+        node = self._root
+        for segment in self._split(route.template):
+            variable = _VARIABLE.match(segment)
+            if variable is None:
+                if '<' in segment:
+                    raise ValueError(
+                        'Cannot compile route template {!r}.'.format(
+                            route.template))
+                node = node.children.setdefault(segment, _Node())
+            else:
+                name = variable.group(1)
+                if node.variable is None:
+                    node.variable = (name, _Node())
+                elif node.variable[0] != name:
+                    raise ValueError(
+                        'Conflicting variables in route template {!r}.'
+                        .format(route.template))
+                node = node.variable[1]
+        for method in route.methods or [None]:
+            node.routes.setdefault(method, route)
+
+    def _split(self, path):
+        if not path.startswith('/'):
+            return None
+        return path[1:].split('/')
+
+    def _find(self, node, segments, method, kwargs):
+        """
+        Returns the route and its arguments for ``segments``. Returns
+        ``None`` if no route matches the path and ``False`` if routes match
+        the path but not ``method``.
+        """
+        if not segments:
+            route = node.routes.get(method) or node.routes.get(None)
+            if route is None:
+                return False if node.routes else None
+            return route, kwargs
+        segment, rest = segments[0], segments[1:]
+        result = None
+        child = node.children.get(segment)
+        if child is not None:
+            result = self._find(child, rest, method, kwargs)
+            if result:
+                return result
+        if node.variable is not None and segment:
+            name, child = node.variable
+            kwargs = dict(kwargs)
+            kwargs[name] = segment
+            found = self._find(child, rest, method, kwargs)
+            if found or result is None:
+                result = found
+        return result
+
+    def match(self, request):
+        path = urllib.unquote(request.path)
+        if not path.startswith(self.template):
+            return None
+        segments = self._split(path[len(self.template):])
+        if segments is None:
+            return None
+        result = self._find(self._root, segments, request.method, {})
+        if result is False:
+            raise exc.HTTPMethodNotAllowed()
+        if result is None:
+            return None
+        route, kwargs = result
+        if route.schemes and request.scheme not in route.schemes:
+            return None
+        if route.defaults:
+            kwargs = dict(route.defaults, **kwargs)
+        return route, (), kwargs
+
+    def get_build_routes(self):
+        for route in self._routes:
+            for name, build_route in route.get_build_routes():
+                if self.template:
+                    build_route = copy.copy(build_route)
+                    # Drop the parsed template so that it is parsed again
+                    # with the prefix.
+                    build_route.__dict__.pop('regex', None)
+                    build_route.template = self.template + build_route.template
+                yield name, build_route
+
+    def __repr__(self):
+        return '<CompiledRoute({!r})>'.format(self.template)
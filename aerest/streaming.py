@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+    aerest.streaming
+    ====================
+
+    Helpers to encode collection responses one entity at a time.
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+import json
+
+
+class EntityStream(object):
+    """
+    Iterates over up to ``limit`` entities of an ``ndb.Query``. Entities are
+    fetched from the datastore ``batch_size`` at a time, so only one batch is
+    held in memory.
+
+    If given, ``check`` is called with each entity before it is yielded, e.g.
+    to check authorization. ``prefetch_size`` sets the size of the first
+    batch, see ``ndb.QueryOptions``.
+    """
+
+    def __init__(self, query, limit, cursor=None, batch_size=50, check=None,
+                 prefetch_size=None):
+        self.query = query
+        self.limit = limit
+        self.cursor = cursor
+        self.batch_size = batch_size
+        self.check = check
+        self.prefetch_size = prefetch_size
+        self._iterator = None
+        self._count = 0
+
+    def __iter__(self):
+        self._iterator = self.query.iter(
+            start_cursor=self.cursor,
+            batch_size=min(self.batch_size, self.limit),
+            prefetch_size=self.prefetch_size,
+            produce_cursors=True)
+        for e in self._iterator:
+            if self.check is not None:
+                self.check(e)
+            self._count += 1
+            yield e
+            if self._count >= self.limit:
+                break
+
+    def next_cursor(self):
+        """
+        Returns a tuple of ``(next_cursor, more)`` once the stream has been
+        consumed, mirroring the values returned by ``ndb.Query.fetch_page``.
+        """
+        if self._iterator is None or not self._count:
+            return None, False
+        return (self._iterator.cursor_after(),
+                self._iterator.probably_has_next())
+
+
+def encode_collection(name, entities, extra=None):
+    """
+    Yields the JSON encoding of ``{name: [e.data for e in entities]}`` in
+    chunks, one per entity.
+
+    ``extra`` is an optional callable returning a dictionary of additional
+    members. It is called after ``entities`` has been consumed, so it may
+    depend on the iteration, e.g. to return the next cursor.
+    """
+    yield '{{{}: ['.format(json.dumps(name))
+    sep = ''
+    for e in entities:
+        yield sep + json.dumps(e.data)
+        sep = ', '
+    yield ']'
+    if extra is not None:
+        for k, v in extra().iteritems():
+            yield ', {}: {}'.format(json.dumps(k), json.dumps(v))
+    yield '}'
+
+
+def decode_lines(lines):
+    """
+    Decodes newline-delimited JSON one line at a time. Yields a tuple of
+    ``(line_number, document, error)`` for each line that is not blank, where
+    ``error`` is the exception raised while decoding it, or ``None``.
+    """
+    for n, line in enumerate(lines, 1):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            yield n, json.loads(line), None
+        except ValueError, e:
+            yield n, None, e
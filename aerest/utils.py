@@ -0,0 +1,35 @@
+# -*- coding: utf-8 -*-
+"""
+    aerest.utils
+    ====================
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+
+def chunks(items, size):
+    """
+    Splits the list ``items`` in to lists of at most ``size`` items.
+    """
+    return [items[i:i + size] for i in xrange(0, len(items), size)]
+
+
+def merge_patch(target, patch):
+    """
+    Returns the result of applying the JSON Merge Patch ``patch`` to
+    ``target``, as defined by RFC 7386. ``target`` is not modified.
+    """
+    if not isinstance(patch, dict):
+        return patch
+    if isinstance(target, dict):
+        target = dict(target)
+    else:
+        target = {}
+    for name, value in patch.iteritems():
+        if value is None:
+            target.pop(name, None)
+        else:
+            target[name] = merge_patch(target.get(name), value)
+    return target
@@ -0,0 +1,329 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.resources_benchmark
+    ==============================
+
+    Runs every handler of ``NDBResource.get_routes`` in process against the
+    App Engine testbed stubs and reports latency percentiles, datastore RPCs
+    and the number of bytes sent and received per request.
+
+    Each scenario is a combination of an authorization stack, a collection
+    size, the number of entities sent or requested by collection handlers,
+    and a ``batch_size`` of the resource::
+
+        python -m benchmarks.resources_benchmark \\
+            --sizes 10,100 --batch-sizes 100,500 --auth open,admin,owned \\
+            --repeat 20 --format json --output results.json
+
+    The JSON output is a list with an object per scenario and handler, so
+    that the results of two releases can be compared by a script.
+
+    :copyright: 2012 by Kyle Finley.
+    :license: Apache Software License, see LICENSE for details.
+
+"""
+
+import argparse
+import collections
+import json
+import math
+import sys
+import time
+
+from google.appengine.api import apiproxy_stub_map
+from google.appengine.datastore import datastore_stub_util
+from google.appengine.ext import ndb
+from google.appengine.ext import testbed
+
+import webapp2
+
+from aerest.authorization import AdminAuthorization
+from aerest.authorization import Authorization
+from aerest.authorization import ReadAuthorization
+from aerest.authorization import UserOwnedAuthorization
+from aerest.properties import DataProperty
+from aerest.resources import NDBResource
+
+
+class BenchItem(ndb.Model):
+    data = ndb.JsonProperty()
+    owner_ids = DataProperty('ownerIds', repeated=True)
+
+    def is_owner(self, user_id):
+        return str(user_id) in self.owner_ids
+
+
+class BenchUser(object):
+    """
+    Stands in for the ``User`` set on the request by authentication.
+    """
+
+    def __init__(self, roles=()):
+        self.roles = list(roles)
+        self.key = ndb.Key('User', 1)
+
+
+# The authorization backends of each stack and the user making the requests.
+AUTH_STACKS = {
+    'open': ([Authorization], None),
+    'admin': ([ReadAuthorization, AdminAuthorization],
+              BenchUser(['admin'])),
+    'owned': ([UserOwnedAuthorization], BenchUser()),
+    }
+
+
+class RpcCounter(object):
+    """
+    Counts the API calls made through the apiproxy, by ``service.method``.
+    ``record`` is registered as a pre-call hook.
+    """
+
+    def __init__(self):
+        self.counts = collections.Counter()
+
+    def record(self, service, call, request, response):
+        self.counts['{}.{}'.format(service, call)] += 1
+
+    def reset(self):
+        self.counts = collections.Counter()
+
+
+def percentile(values, p):
+    """
+    Returns the ``p``th percentile of ``values`` by the nearest rank.
+    """
+    values = sorted(values)
+    rank = int(math.ceil(p / 100.0 * len(values))) - 1
+    return values[max(0, min(rank, len(values) - 1))]
+
+
+class Scenario(object):
+    """
+    Seeds entities for, and builds the requests of, one scenario.
+    """
+
+    def __init__(self, resource, size):
+        self.resource = resource
+        self.size = size
+        self.plural = resource.resource_name_plural
+        self.counter = 0
+        self.ids = self.seed(size)
+
+    def seed(self, n):
+        """
+        Writes ``n`` entities outside of the timed requests. Returns their
+        ids.
+        """
+        first, last = BenchItem.allocate_ids(n)
+        entities = [BenchItem(id=id, data=self.item(id))
+                    for id in xrange(first, last + 1)]
+        ndb.put_multi(entities)
+        return [e.key.id() for e in entities]
+
+    def item(self, id=None):
+        self.counter += 1
+        data = {'name': 'item {}'.format(self.counter), 'ownerIds': ['1']}
+        if id is not None:
+            data['id'] = id
+        return data
+
+    def path(self, route, id=None):
+        return route.template.replace('<id>', str(id))
+
+    # Each builder returns a tuple of ``(path, body)`` for a route.
+
+    def find_many(self, route):
+        return '{}?limit={}'.format(self.path(route), self.size), None
+
+    def create(self, route):
+        return self.path(route), {
+            self.plural: [self.item() for i in xrange(self.size)]}
+
+    def update_many(self, route):
+        return self.path(route), {
+            self.plural: [self.item(id) for id in self.ids]}
+
+    def patch_many(self, route):
+        return self.path(route), {
+            self.plural: [{'id': id, 'n': self.counter} for id in self.ids]}
+
+    def delete_many(self, route):
+        return self.path(route), {'ids': self.seed(self.size)}
+
+    def bulk_import(self, route):
+        return self.path(route), '\n'.join(
+            json.dumps(self.item()) for i in xrange(self.size))
+
+    def bulk_export(self, route):
+        return '{}?limit={}'.format(self.path(route), self.size), None
+
+    def find(self, route):
+        return self.path(route, self.ids[0]), None
+
+    def update(self, route):
+        id = self.ids[0]
+        return self.path(route, id), {
+            self.resource.resource_name: self.item(id)}
+
+    def patch(self, route):
+        return self.path(route, self.ids[0]), {
+            self.resource.resource_name: {'n': self.counter}}
+
+    def delete(self, route):
+        return self.path(route, self.seed(1)[0]), None
+
+    def build(self, route):
+        builder = getattr(self, route.handler_method, None)
+        if builder is None:
+            raise KeyError(
+                'No benchmark request for handler {!r}.'.format(
+                    route.handler_method))
+        self.counter += 1
+        path, body = builder(route)
+        if body is not None and not isinstance(body, basestring):
+            body = json.dumps(body)
+        return path, body
+
+
+def run_scenario(auth, size, batch_size, repeat, counter):
+    authorization, user = AUTH_STACKS[auth]
+    resource = type('BenchResource', (NDBResource,), {
+        'resource_model': BenchItem,
+        'resource_name': 'item',
+        'resource_name_plural': 'items',
+        'authorization': authorization,
+        'batch_size': batch_size,
+        'max_limit': max(size, NDBResource.max_limit),
+        })
+    routes = resource.get_routes()
+    application = webapp2.WSGIApplication(routes)
+    application.allowed_methods = NDBResource.get_allowed_methods(
+        application)
+    scenario = Scenario(resource, size)
+
+    results = []
+    for route in routes:
+        method = route.methods[0]
+        latencies = []
+        rpcs = collections.Counter()
+        bytes_in = bytes_out = 0
+        statuses = collections.Counter()
+        for i in xrange(repeat):
+            path, body = scenario.build(route)
+            request = webapp2.Request.blank(path)
+            request.method = method
+            request.user = user
+            if body is not None:
+                request.body = body
+            # Each request starts with an empty context cache, as it would
+            # on a new request in production.
+            ndb.get_context().clear_cache()
+            counter.reset()
+            start = time.time()
+            response = request.get_response(application)
+            latencies.append((time.time() - start) * 1000.0)
+            rpcs.update(counter.counts)
+            bytes_in += len(body or '')
+            bytes_out += len(response.body)
+            statuses[response.status_int] += 1
+        results.append({
+            'auth': auth,
+            'size': size,
+            'batch_size': batch_size,
+            'handler': route.handler_method,
+            'method': method,
+            'route': route.template,
+            'repeat': repeat,
+            'status': dict(statuses),
+            'latency_ms': {
+                'p50': percentile(latencies, 50),
+                'p90': percentile(latencies, 90),
+                'p99': percentile(latencies, 99),
+                'mean': sum(latencies) / len(latencies),
+                },
+            'rpcs': dict((k, float(v) / repeat) for k, v in rpcs.items()),
+            'bytes_in': bytes_in / repeat,
+            'bytes_out': bytes_out / repeat,
+            })
+    return results
+
+
+def run(sizes, batch_sizes, auths, repeat):
+    results = []
+    for auth in auths:
+        for size in sizes:
+            for batch_size in batch_sizes:
+                # A fresh datastore per scenario.
+                bed = testbed.Testbed()
+                bed.activate()
+                bed.init_datastore_v3_stub(
+                    consistency_policy=datastore_stub_util.
+                    PseudoRandomHRConsistencyPolicy(probability=1))
+                bed.init_memcache_stub()
+                counter = RpcCounter()
+                # The apiproxy only accepts functions and methods as hooks.
+                apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+                    'aerest_benchmark', counter.record)
+                try:
+                    results.extend(run_scenario(
+                        auth, size, batch_size, repeat, counter))
+                finally:
+                    bed.deactivate()
+    return results
+
+
+def format_text(results):
+    lines = ['{:<6} {:>5} {:>5} {:<12} {:<6} {:>9} {:>9} {:>9} {:>6} '
+             '{:>9}'.format('auth', 'size', 'batch', 'handler', 'method',
+                            'p50 ms', 'p90 ms', 'p99 ms', 'rpcs',
+                            'bytes out')]
+    for r in results:
+        row = dict(r, **r['latency_ms'])
+        row['rpcs'] = sum(r['rpcs'].values())
+        lines.append(
+            '{auth:<6} {size:>5} {batch_size:>5} {handler:<12} {method:<6} '
+            '{p50:>9.2f} {p90:>9.2f} {p99:>9.2f} {rpcs:>6.1f} '
+            '{bytes_out:>9}'.format(**row))
+    return '\n'.join(lines) + '\n'
+
+
+def parse_list(value):
+    return [v for v in value.split(',') if v]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[1])
+    parser.add_argument('--sizes', default='10,100', type=parse_list,
+                        help='Comma separated collection sizes.')
+    parser.add_argument('--batch-sizes', default='500', type=parse_list,
+                        help='Comma separated values of batch_size.')
+    parser.add_argument('--auth', default='open', type=parse_list,
+                        help='Comma separated authorization stacks: '
+                             '{}.'.format(', '.join(sorted(AUTH_STACKS))))
+    parser.add_argument('--repeat', default=20, type=int,
+                        help='Number of requests per handler.')
+    parser.add_argument('--format', default='text', choices=['text', 'json'])
+    parser.add_argument('--output', default='-',
+                        help='File to write the results to.')
+    args = parser.parse_args(argv)
+
+    for auth in args.auth:
+        if auth not in AUTH_STACKS:
+            parser.error('Unknown authorization stack: {}'.format(auth))
+
+    results = run([int(s) for s in args.sizes],
+                  [int(b) for b in args.batch_sizes],
+                  args.auth, args.repeat)
+    if args.format == 'json':
+        output = json.dumps(results, indent=2, sort_keys=True) + '\n'
+    else:
+        output = format_text(results)
+    if args.output == '-':
+        sys.stdout.write(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    main()
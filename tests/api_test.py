@@ -1,9 +1,14 @@
 from aecore.test_utils import BaseTestCase
 from aerest.resources import NDBResource
 from aerest.api import Api
+from aerest.authorization import Authorization
+from aerest.authorization import ReadAuthorization
 
+from google.appengine.api import apiproxy_stub_map
 from google.appengine.ext import ndb
 
+import json
+import sys
 import webapp2
 from webapp2_extras.routes import PathPrefixRoute
 
@@ -26,6 +31,15 @@ class HouseResource(NDBResource):
     resource_name_plural = 'addresses'
 
 
+class Note(ndb.Model):
+    data = ndb.JsonProperty()
+
+class NoteResource(NDBResource):
+    resource_model = Note
+    resource_name = 'note'
+    authorization = [Authorization]
+
+
 api_v1 = Api()
 api_v1.register(PersonResource)
 api_v1.register(HouseResource)
@@ -36,6 +50,56 @@ routes = [
 
 application = webapp2.WSGIApplication(routes)
 
+class ReadOnlyNoteResource(NoteResource):
+    resource_name = 'memo'
+    authorization = [ReadAuthorization]
+
+
+api_batch = Api(batch=True)
+api_batch.register(NoteResource)
+api_batch.register(ReadOnlyNoteResource)
+
+batch_application = webapp2.WSGIApplication([
+    PathPrefixRoute(r'/api/v1', api_batch.get_routes()),
+    ])
+
+api_metrics = Api(metrics=True)
+api_metrics.register(NoteResource)
+
+metrics_application = webapp2.WSGIApplication([
+    PathPrefixRoute(r'/api/v1', api_metrics.get_routes()),
+    ])
+
+
+def create_note(text):
+    fid, lid = Note.allocate_ids(1)
+    n = Note(id=fid, data={'id': fid, 'text': text})
+    n.put()
+    return n
+
+def batch_request(operations, application=batch_application):
+    request = webapp2.Request.blank('/api/v1/batch')
+    request.method = 'POST'
+    request.body = json.dumps({'operations': operations})
+    response = request.get_response(application)
+    return response.status, json.loads(response.body)
+
+
+class RpcCounter(object):
+    """
+    Counts the datastore calls by method, ``record`` is registered as a
+    pre-call hook.
+    """
+
+    def __init__(self):
+        self.counts = {}
+        apiproxy_stub_map.apiproxy.GetPreCallHooks().Append(
+            'aerest_test_counter', self.record)
+
+    def record(self, service, call, request, response):
+        if service == 'datastore_v3':
+            self.counts[call] = self.counts.get(call, 0) + 1
+
 
 class TestApi(BaseTestCase):
 
@@ -44,4 +108,215 @@ class TestApi(BaseTestCase):
 
     def test_get_routes(self):
         routes = api_v1.get_routes()
-        self.assertEqual(len(routes), 14)
+        self.assertEqual(len(routes), 22)
+
+    def test_get_routes_batch(self):
+        routes = api_batch.get_routes()
+        self.assertEqual(len(routes), 23)
+
+    def test_get_routes_compiled(self):
+        routes = api_v1.get_routes(compiled=True)
+        self.assertEqual(len(routes), 1)
+
+        application = webapp2.WSGIApplication([
+            PathPrefixRoute(r'/api/v1', routes)])
+        request = webapp2.Request.blank('/api/v1/people/1')
+        response = request.get_response(application)
+        self.assertEqual(response.status_int, 404)
+        request = webapp2.Request.blank('/api/v1/people/1')
+        request.method = 'POST'
+        response = request.get_response(application)
+        self.assertEqual(response.status_int, 405)
+
+    def test_get_routes_metrics(self):
+        routes = api_metrics.get_routes()
+        self.assertEqual(len(routes), 12)
+
+
+class TestBatch(BaseTestCase):
+
+    def setUp(self):
+        super(TestBatch, self).setUp()
+        self.register_model('Note', Note)
+
+    def test_batch(self):
+        n1 = create_note('one')
+        n2 = create_note('two')
+        id1 = n1.key.id()
+        id2 = n2.key.id()
+
+        status, body = batch_request([
+            {'method': 'GET', 'path': '/notes/{}'.format(id1)},
+            {'method': 'PUT', 'path': '/notes/{}'.format(id2),
+             'body': {'note': {'id': id2, 'text': 'TWO'}}},
+            {'method': 'POST', 'path': '/notes',
+             'body': {'note': {'text': 'three'}}},
+            {'method': 'DELETE', 'path': '/notes/{}'.format(id1)},
+            {'method': 'GET', 'path': '/missing'},
+            ])
+
+        self.assertEqual(status, '200 OK')
+        results = body['results']
+        self.assertEqual([r['status'] for r in results],
+                         [200, 200, 200, 200, 404])
+        self.assertEqual(results[0]['body']['note']['text'], 'one')
+        self.assertEqual(results[1]['body']['note']['text'], 'TWO')
+
+        # The writes were made.
+        self.assertEqual(Note.get_by_id(id1), None)
+        self.assertEqual(Note.get_by_id(id2).data['text'], 'TWO')
+        id3 = results[2]['body']['note']['id']
+        self.assertEqual(Note.get_by_id(id3).data['text'], 'three')
+
+    def test_batch_rpcs(self):
+        n1 = create_note('one')
+        n2 = create_note('two')
+        id1 = n1.key.id()
+        id2 = n2.key.id()
+        # Read the entities from the datastore, not from the context cache.
+        ndb.get_context().clear_cache()
+        counter = RpcCounter()
+
+        status, body = batch_request([
+            {'method': 'GET', 'path': '/notes/{}'.format(id1)},
+            {'method': 'GET', 'path': '/notes/{}'.format(id2)},
+            {'method': 'PUT', 'path': '/notes/{}'.format(id1),
+             'body': {'note': {'id': id1, 'text': 'ONE'}}},
+            {'method': 'PUT', 'path': '/notes/{}'.format(id2),
+             'body': {'note': {'id': id2, 'text': 'TWO'}}},
+            ])
+
+        self.assertEqual([r['status'] for r in body['results']],
+                         [200, 200, 200, 200])
+        # The reads are merged into one get_multi and the writes into one
+        # put_multi.
+        self.assertEqual(counter.counts.get('Get'), 1)
+        self.assertEqual(counter.counts.get('Put'), 1)
+
+    def test_denied_without_reads(self):
+        n1 = create_note('one')
+        ndb.get_context().clear_cache()
+        counter = RpcCounter()
+
+        status, body = batch_request([
+            {'method': 'PUT', 'path': '/memos/{}'.format(n1.key.id()),
+             'body': {'memo': {'id': n1.key.id(), 'text': 'ONE'}}},
+            {'method': 'DELETE', 'path': '/memos/{}'.format(n1.key.id())},
+            ])
+
+        self.assertEqual([r['status'] for r in body['results']], [401, 401])
+        self.assertEqual(counter.counts.get('Get'), None)
+        self.assertEqual(Note.get_by_id(n1.key.id()).data['text'], 'one')
+
+    def test_register(self):
+        api = Api(batch=True)
+        api.register(NoteResource)
+        application = webapp2.WSGIApplication([
+            PathPrefixRoute(r'/api/v1', api.get_routes())])
+        operations = [{'method': 'POST', 'path': '/memos',
+                       'body': {'memo': {'text': 'one'}}}]
+
+        status, body = batch_request(operations, application)
+        self.assertEqual(body['results'][0]['status'], 404)
+
+        # The operations are routed to resources registered later on.
+        api.register(ReadOnlyNoteResource)
+        status, body = batch_request(operations, application)
+        self.assertEqual(body['results'][0]['status'], 401)
+
+        api.unregister('memo')
+        status, body = batch_request(operations, application)
+        self.assertEqual(body['results'][0]['status'], 404)
+
+    def test_bad_request(self):
+        request = webapp2.Request.blank('/api/v1/batch')
+        request.method = 'POST'
+        request.body = json.dumps({'ops': []})
+        response = request.get_response(batch_application)
+        self.assertEqual(response.status_int, 400)
+
+
+class TestMetrics(BaseTestCase):
+
+    def setUp(self):
+        super(TestMetrics, self).setUp()
+        self.register_model('Note', Note)
+
+    def get(self, path):
+        request = webapp2.Request.blank(path)
+        return request.get_response(metrics_application)
+
+    def test_metrics(self):
+        n1 = create_note('one')
+        url = '/api/v1/notes/{}'.format(n1.key.id())
+        self.assertEqual(self.get(url).status_int, 200)
+        self.assertEqual(self.get(url).status_int, 200)
+        missing = '/api/v1/notes/{}'.format(n1.key.id() + 1000)
+        self.assertEqual(self.get(missing).status_int, 404)
+
+        response = self.get('/api/v1/_metrics')
+        self.assertEqual(response.status_int, 200)
+        lines = response.body.splitlines()
+        labels = 'method="GET",route="/api/v1/notes/<id>"'
+        self.assertTrue(
+            'aerest_requests_total{{{},status="200"}} 2'.format(labels)
+            in lines)
+        self.assertTrue(
+            'aerest_requests_total{{{},status="404"}} 1'.format(labels)
+            in lines)
+        self.assertTrue(
+            'aerest_request_duration_seconds_bucket{{le="+Inf",{}}} 3'
+            .format(labels) in lines)
+        self.assertTrue(
+            'aerest_request_duration_seconds_count{{{}}} 3'.format(labels)
+            in lines)
+
+
+class TestLazyResource(BaseTestCase):
+
+    def test_register_path(self):
+        module = 'tests.lazy_resource'
+        sys.modules.pop(module, None)
+        api = Api(batch=True)
+        api.register('{}.TreeResource'.format(module), 'tree')
+        routes = api.get_routes()
+        self.assertEqual(len(routes), 12)
+        self.assertFalse(module in sys.modules)
+
+        application = webapp2.WSGIApplication([
+            PathPrefixRoute(r'/api/v1', routes)])
+        request = webapp2.Request.blank('/api/v1/trees')
+        request.method = 'POST'
+        request.body = json.dumps({'tree': {'name': 'oak'}})
+        response = request.get_response(application)
+        self.assertEqual(response.status_int, 200)
+        self.assertTrue(module in sys.modules)
+        id = json.loads(response.body)['tree']['id']
+
+        request = webapp2.Request.blank('/api/v1/batch')
+        request.method = 'POST'
+        request.body = json.dumps({'operations': [
+            {'method': 'GET', 'path': '/trees/{}'.format(id)}]})
+        response = request.get_response(application)
+        result = json.loads(response.body)['results'][0]
+        self.assertEqual(result['body']['tree']['name'], 'oak')
+
+    def test_register_path_metrics(self):
+        module = 'tests.lazy_resource'
+        sys.modules.pop(module, None)
+        api = Api(metrics=True)
+        api.register('{}.TreeResource'.format(module), 'tree')
+        application = webapp2.WSGIApplication([
+            PathPrefixRoute(r'/api/v1', api.get_routes())])
+        self.assertFalse(module in sys.modules)
+
+        request = webapp2.Request.blank('/api/v1/trees/1')
+        self.assertEqual(request.get_response(application).status_int, 404)
+        self.assertTrue(module in sys.modules)
+        requests, histograms = api.metrics.snapshot()
+        self.assertEqual(requests, {('/api/v1/trees/<id>', 'GET', 404): 1})
+
+    def test_register_path_requires_name(self):
+        api = Api()
+        self.assertRaises(Exception, api.register,
+                          'tests.lazy_resource.TreeResource')
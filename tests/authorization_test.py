@@ -1,8 +1,11 @@
 from aecore.test_utils import BaseTestCase
 from aerest.resources import NDBResource
 from aerest.authentication import AECoreAuthentication
+from aerest.authorization import Authorization
 from aerest.authorization import AdminAuthorization
+from aerest.authorization import ReadAuthorization
 from aerest.authorization import UserOwnedAuthorization
+from aerest.properties import DataProperty
 from google.appengine.ext import ndb
 from aecore.models import Config
 from aecore.models import User
@@ -28,6 +31,20 @@ class Person(ndb.Model):
         except Exception:
             return None
 
+    # Number of datastore reads, see ``TestPreAuthorization``.
+    reads = 0
+
+    @classmethod
+    def _pre_get_hook(cls, key):
+        cls.reads += 1
+
+class OwnedPerson(ndb.Model):
+    data = ndb.JsonProperty()
+    owner_ids = DataProperty('ownerIds', repeated=True)
+
+    def is_owner(self, user_id):
+        return str(user_id) in self.owner_ids
+
 class PersonResource(NDBResource):
     resource_model = Person
     resource_name = 'person'
@@ -38,8 +55,37 @@ class PersonResource(NDBResource):
     authorization = [AdminAuthorization, UserOwnedAuthorization]
 
 
+class ReadOnlyPersonResource(PersonResource):
+    # Anyone may read, only admins may modify.
+    authorization = [ReadAuthorization, AdminAuthorization]
+
+
+class BillOnlyAuthorization(Authorization):
+    # Does not declare ``requires_object``, like most custom backends.
+
+    def is_authorized(self, request, object=None):
+        if object is None:
+            return True
+        return object.data['name'] == 'Bill Clinton'
+
+
+class BillOnlyPersonResource(PersonResource):
+    authorization = [BillOnlyAuthorization]
+
+
+class OwnedPersonResource(NDBResource):
+    resource_model = OwnedPerson
+    resource_name = 'person'
+    resource_name_plural = 'people'
+    authentication = AECoreAuthentication
+    authorization = [AdminAuthorization, UserOwnedAuthorization]
+
+
 application = webapp2.WSGIApplication([
     PathPrefixRoute(r'/api', PersonResource.get_routes()),
+    PathPrefixRoute(r'/readonly', ReadOnlyPersonResource.get_routes()),
+    PathPrefixRoute(r'/owned', OwnedPersonResource.get_routes()),
+    PathPrefixRoute(r'/bill', BillOnlyPersonResource.get_routes()),
     ])
 
 
@@ -73,6 +119,171 @@ def create_user(role=None, id=1):
     u.put()
     return u
 
+class TestIsAuthorizedMany(BaseTestCase):
+
+    def setUp(self):
+        super(TestIsAuthorizedMany, self).setUp()
+        self.register_model('Person', Person)
+        self.register_model('User', User)
+
+    def test_default(self):
+        request = webapp2.Request.blank('/api/people')
+        objects = [create_person('Bill Clinton'), None]
+        self.assertEqual(
+            Authorization().is_authorized_many(request, objects),
+            [True, True])
+
+    def test_requires_object(self):
+        class NotNoneAuthorization(Authorization):
+            requires_object = True
+
+            def is_authorized(self, request, object=None):
+                return object is not None
+
+        request = webapp2.Request.blank('/api/people')
+        objects = [create_person('Bill Clinton'), None]
+        self.assertEqual(
+            NotNoneAuthorization().is_authorized_many(request, objects),
+            [True, False])
+
+    def test_undeclared_requires_object(self):
+        request = webapp2.Request.blank('/api/people')
+        objects = [create_person('Bill Clinton'),
+                   create_person('George Washington')]
+        self.assertEqual(
+            BillOnlyAuthorization().is_authorized_many(request, objects),
+            [True, False])
+
+    def test_read(self):
+        request = webapp2.Request.blank('/api/people')
+        objects = [create_person('Bill Clinton'), None]
+        self.assertEqual(
+            ReadAuthorization().is_authorized_many(request, objects),
+            [True, True])
+        request.method = 'DELETE'
+        self.assertEqual(
+            ReadAuthorization().is_authorized_many(request, objects),
+            [False, False])
+
+    def test_user_owned(self):
+        request = webapp2.Request.blank('/api/people')
+        request.method = 'PUT'
+        request.user = None
+        objects = [create_person('Bill Clinton')]
+        self.assertEqual(
+            UserOwnedAuthorization().is_authorized_many(request, objects),
+            [False])
+        request.method = 'POST'
+        self.assertEqual(
+            UserOwnedAuthorization().is_authorized_many(request, objects),
+            [True])
+
+
+class TestPreAuthorization(BaseTestCase):
+
+    def setUp(self):
+        super(TestPreAuthorization, self).setUp()
+        self.register_model('Person', Person)
+        self.register_model('Config', Config)
+        self.register_model('User', User)
+        self.register_model('UserProfile', UserProfile)
+        self.user = create_user(id=2)
+
+    def test_denied_without_reads(self):
+        p1 = create_person('Bill Clinton')
+        p2 = create_person('George Washington')
+        Person.reads = 0
+
+        url = '/readonly/people/{}'.format(p1.key.id())
+        s1, r1, b1 = create_request('DELETE', url, user=self.user)
+        self.assertEqual(s1, '401 Unauthorized')
+
+        url = '/readonly/people'
+        request_dict = {'ids': [p1.key.id(), p2.key.id()]}
+        s2, r2, b2 = create_request('DELETE', url, request_dict, user=self.user)
+        self.assertEqual(s2, '401 Unauthorized')
+
+        self.assertEqual(Person.reads, 0)
+        self.assertTrue(Person.get_by_id(p1.key.id()) is not None)
+
+    def test_delete_without_reads(self):
+        admin = create_user(role='admin', id=3)
+        p1 = create_person('Bill Clinton')
+        p2 = create_person('George Washington')
+        p3 = create_person('Ronald Reagan')
+        Person.reads = 0
+
+        url = '/readonly/people/{}'.format(p1.key.id())
+        s1, r1, b1 = create_request('DELETE', url, user=admin)
+        self.assertEqual(s1, '200 OK')
+
+        url = '/readonly/people'
+        request_dict = {'ids': [p2.key.id(), p3.key.id()]}
+        s2, r2, b2 = create_request('DELETE', url, request_dict, user=admin)
+        self.assertEqual(s2, '200 OK')
+        self.assertEqual(b2, [None, None])
+
+        # No entity was read before deleting it.
+        self.assertEqual(Person.reads, 0)
+        self.assertEqual(ndb.get_multi([p1.key, p2.key, p3.key]),
+                         [None, None, None])
+
+    def test_needs_object(self):
+        self.assertFalse(Authorization.needs_object())
+        self.assertFalse(ReadAuthorization.needs_object())
+        self.assertFalse(AdminAuthorization.needs_object())
+        self.assertTrue(UserOwnedAuthorization.needs_object())
+        # Overriding ``is_authorized`` without declaring it.
+        self.assertTrue(BillOnlyAuthorization.needs_object())
+
+    def test_undeclared_row_level(self):
+        p1 = create_person('Bill Clinton')
+        p2 = create_person('George Washington')
+
+        url = '/bill/people/{}'.format(p1.key.id())
+        s1, r1, b1 = create_request('GET', url, user=self.user)
+        self.assertEqual(s1, '200 OK')
+
+        url = '/bill/people/{}'.format(p2.key.id())
+        s2, r2, b2 = create_request('GET', url, user=self.user)
+        self.assertEqual(s2, '401 Unauthorized')
+
+    def test_allowed(self):
+        p1 = create_person('Bill Clinton')
+        url = '/readonly/people/{}'.format(p1.key.id())
+        s1, r1, b1 = create_request('GET', url, user=self.user)
+        self.assertEqual(s1, '200 OK')
+        self.assertEqual(b1['person']['name'], 'Bill Clinton')
+
+
+class TestUserOwnedQuery(BaseTestCase):
+
+    def setUp(self):
+        super(TestUserOwnedQuery, self).setUp()
+        self.register_model('OwnedPerson', OwnedPerson)
+        self.register_model('Config', Config)
+        self.register_model('User', User)
+        self.register_model('UserProfile', UserProfile)
+        self.user = create_user(id=1)
+
+    def test_find_many(self):
+        p1 = OwnedPerson(data={'name': 'Bill Clinton', 'ownerIds': ['1']})
+        p2 = OwnedPerson(data={'name': 'George Washington',
+                               'ownerIds': ['2']})
+        p3 = OwnedPerson(data={'name': 'Ronald Reagan',
+                               'ownerIds': ['1', '2']})
+        ndb.put_multi([p1, p2, p3])
+        self.assertEqual(p3.owner_ids, ['1', '2'])
+
+        # Only the user's entities are read, the foreign one is not an error.
+        s1, r1, b1 = create_request('GET', '/owned/people', user=self.user)
+
+        self.assertEqual(s1, '200 OK')
+        # put_multi allocates scattered ids, so compare regardless of order.
+        self.assertEqual(sorted(p['name'] for p in b1['people']),
+                         ['Bill Clinton', 'Ronald Reagan'])
+
+
 class TestAdminAuthorization(BaseTestCase):
 
     def setUp(self):
@@ -0,0 +1,54 @@
+from aecore.test_utils import BaseTestCase
+from aerest.batch import BatchError
+from aerest.batch import map_chunks_async
+
+from google.appengine.ext import ndb
+
+
+class Person(ndb.Model):
+    data = ndb.JsonProperty()
+
+
+class TestMapChunks(BaseTestCase):
+
+    def setUp(self):
+        super(TestMapChunks, self).setUp()
+        self.register_model('Person', Person)
+
+    def test_put_and_get(self):
+        people = [Person(data={'n': i}) for i in range(25)]
+        calls = []
+
+        def put_multi_async(batch):
+            calls.append(len(batch))
+            return ndb.put_multi_async(batch)
+
+        keys, errors = map_chunks_async(
+            put_multi_async, people, size=10, concurrency=2).get_result()
+        self.assertEqual(calls, [10, 10, 5])
+        self.assertEqual(errors, {})
+        self.assertEqual(len(keys), 25)
+
+        found, errors = map_chunks_async(
+            ndb.get_multi_async, keys, size=10).get_result()
+        self.assertEqual([p.data['n'] for p in found], range(25))
+
+    def test_partial_failure(self):
+        people = [Person(data={'n': i}) for i in range(4)]
+
+        def put_multi_async(batch):
+            if batch[0].data['n'] == 2:
+                future = ndb.Future()
+                future.set_exception(ValueError('failed'))
+                return [future] * len(batch)
+            return ndb.put_multi_async(batch)
+
+        keys, errors = map_chunks_async(
+            put_multi_async, people, size=2).get_result()
+        self.assertEqual(sorted(errors), [2, 3])
+        self.assertEqual(keys[2:], [None, None])
+        self.assertTrue(keys[0] is not None)
+
+        error = BatchError(people[:2], errors)
+        self.assertEqual(error.to_list(), [{'index': 2, 'error': 'failed'},
+                                           {'index': 3, 'error': 'failed'}])
@@ -0,0 +1,50 @@
+from aecore.test_utils import BaseTestCase
+from aerest.idpool import IdPool
+
+from google.appengine.ext import ndb
+
+
+class Person(ndb.Model):
+    data = ndb.JsonProperty()
+
+
+class TestIdPool(BaseTestCase):
+
+    def setUp(self):
+        super(TestIdPool, self).setUp()
+        self.register_model('Person', Person)
+
+    def test_take(self):
+        pool = IdPool(Person, size=10)
+        self.assertEqual(pool.take(1), None)
+
+        ids = pool.take_async(3).get_result()
+        self.assertEqual(len(set(ids)), 3)
+        self.assertEqual(pool.available, 7)
+
+        # Taking from the pool does not reserve new ids.
+        more = pool.take(7)
+        self.assertEqual(len(more), 7)
+        self.assertEqual(set(ids) & set(more), set())
+        self.assertEqual(pool.available, 0)
+
+    def test_take_more_than_size(self):
+        pool = IdPool(Person, size=10)
+        ids = pool.take_async(25).get_result()
+        self.assertEqual(len(set(ids)), 25)
+
+    def test_refill_if_low(self):
+        pool = IdPool(Person, size=8, low_water=4)
+        pool.take_async(5).get_result()
+        self.assertEqual(pool.available, 3)
+        pool.refill_if_low_async().get_result()
+        self.assertEqual(pool.available, 11)
+        # Not low anymore, nothing is reserved.
+        pool.refill_if_low_async().get_result()
+        self.assertEqual(pool.available, 11)
+
+    def test_ids_are_reserved(self):
+        pool = IdPool(Person, size=10)
+        ids = pool.take_async(10).get_result()
+        first, last = Person.allocate_ids(1)
+        self.assertTrue(first not in ids)
@@ -0,0 +1,17 @@
+"""
+A resource registered by its import path in ``api_test``. It must only be
+imported by the test that requests it.
+"""
+from aerest.resources import NDBResource
+from aerest.authorization import Authorization
+
+from google.appengine.ext import ndb
+
+
+class Tree(ndb.Model):
+    data = ndb.JsonProperty()
+
+class TreeResource(NDBResource):
+    resource_model = Tree
+    resource_name = 'tree'
+    authorization = [Authorization]
@@ -0,0 +1,49 @@
+from aecore.test_utils import BaseTestCase
+from aerest.metrics import RouteMetrics
+
+import threading
+
+
+class TestRouteMetrics(BaseTestCase):
+
+    def test_observe(self):
+        metrics = RouteMetrics(buckets=(0.1, 1.0))
+        metrics.observe('/people', 'GET', 200, 0.05)
+        metrics.observe('/people', 'GET', 200, 0.1)
+        metrics.observe('/people', 'GET', 500, 2.0)
+
+        requests, histograms = metrics.snapshot()
+        self.assertEqual(requests, {('/people', 'GET', 200): 2,
+                                    ('/people', 'GET', 500): 1})
+        # A latency equal to a bound falls in that bucket.
+        self.assertEqual(histograms[('/people', 'GET')][:3], [2, 0, 1])
+
+        lines = metrics.render().splitlines()
+        labels = 'method="GET",route="/people"'
+        for line in [
+                'aerest_requests_total{{{},status="200"}} 2'.format(labels),
+                'aerest_request_duration_seconds_bucket'
+                '{{le="0.1",{}}} 2'.format(labels),
+                'aerest_request_duration_seconds_bucket'
+                '{{le="1.0",{}}} 2'.format(labels),
+                'aerest_request_duration_seconds_bucket'
+                '{{le="+Inf",{}}} 3'.format(labels),
+                'aerest_request_duration_seconds_count{{{}}} 3'.format(
+                    labels)]:
+            self.assertTrue(line in lines, line)
+
+    def test_threads(self):
+        metrics = RouteMetrics()
+
+        def observe():
+            for i in range(1000):
+                metrics.observe('/people', 'GET', 200, 0.01)
+
+        threads = [threading.Thread(target=observe) for i in range(4)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        requests, histograms = metrics.snapshot()
+        self.assertEqual(requests[('/people', 'GET', 200)], 4000)
+        self.assertEqual(sum(histograms[('/people', 'GET')][:-1]), 4000)
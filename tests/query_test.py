@@ -0,0 +1,102 @@
+from aecore.test_utils import BaseTestCase
+from aerest.query import InvalidQuery
+from aerest.query import QueryCompiler
+from aerest.query import parse_query
+
+from google.appengine.ext import ndb
+
+
+class Person(ndb.Model):
+    data = ndb.JsonProperty()
+    name = ndb.StringProperty()
+    age = ndb.IntegerProperty()
+
+
+class TestParseQuery(BaseTestCase):
+
+    def test_shape_ignores_values_and_filter_order(self):
+        s1, v1, l1 = parse_query({
+            'filters': [['name', '=', 'Bill'], ['age', '>=', 18]]})
+        s2, v2, l2 = parse_query({
+            'filters': [['age', '>=', 30], ['name', '==', 'Ron']],
+            'limit': 5})
+        self.assertEqual(s1, s2)
+        self.assertEqual(v1, [18, 'Bill'])
+        self.assertEqual(v2, [30, 'Ron'])
+        self.assertEqual(l1, None)
+        self.assertEqual(l2, 5)
+
+    def test_invalid(self):
+        self.assertRaises(InvalidQuery, parse_query, [])
+        self.assertRaises(InvalidQuery, parse_query, {'select': []})
+        self.assertRaises(InvalidQuery, parse_query,
+                          {'filters': [['name', '~', 'Bill']]})
+        self.assertRaises(InvalidQuery, parse_query,
+                          {'filters': [['name', 'in', 'Bill']]})
+        self.assertRaises(InvalidQuery, parse_query, {'limit': 0})
+
+
+class TestQueryCompiler(BaseTestCase):
+
+    def setUp(self):
+        super(TestQueryCompiler, self).setUp()
+        self.register_model('Person', Person)
+
+    def test_compile(self):
+        Person(name='Bill', age=66).put()
+        Person(name='Ron', age=93).put()
+        compiler = QueryCompiler(Person)
+
+        q, limit = compiler.compile({
+            'filters': [['age', '>', 70]], 'order': ['-age']})
+        self.assertEqual([p.name for p in q.fetch()], ['Ron'])
+
+        # The compiled query is reused for the same shape.
+        self.assertEqual(len(compiler._cache), 1)
+        q, limit = compiler.compile({'filters': [['age', '>', 10]],
+                                     'order': ['-age']})
+        self.assertEqual(len(compiler._cache), 1)
+        self.assertEqual([p.name for p in q.fetch()], ['Ron', 'Bill'])
+
+    def test_compile_multi_query(self):
+        Person(name='Bill', age=66).put()
+        Person(name='Ron', age=93).put()
+        Person(name='George', age=67).put()
+        compiler = QueryCompiler(Person)
+
+        # Merged queries can be paged through with cursors.
+        q, limit = compiler.compile({'filters': [['age', 'in', [66, 93]]]})
+        people, cursor, more = q.fetch_page(1)
+        self.assertEqual(len(people), 1)
+        people, cursor, more = q.fetch_page(1, start_cursor=cursor)
+        self.assertEqual(len(people), 1)
+
+        q, limit = compiler.compile({'filters': [['age', '!=', 67]]})
+        people, cursor, more = q.fetch_page(5)
+        self.assertEqual([p.name for p in people], ['Bill', 'Ron'])
+
+    def test_compile_inequality(self):
+        Person(name='Bill', age=66).put()
+        Person(name='Ron', age=93).put()
+        compiler = QueryCompiler(Person)
+
+        # The inequality property is sorted on first if no order is given.
+        q, limit = compiler.compile({'filters': [['age', '<', 100]]})
+        self.assertEqual([p.name for p in q.fetch()], ['Bill', 'Ron'])
+
+        q, limit = compiler.compile({'filters': [['age', '>', 18]],
+                                     'order': ['-age', 'name']})
+        self.assertEqual([p.name for p in q.fetch()], ['Ron', 'Bill'])
+
+        self.assertRaises(InvalidQuery, compiler.compile, {
+            'filters': [['age', '>', 18]], 'order': ['name']})
+        self.assertRaises(InvalidQuery, compiler.compile, {
+            'filters': [['age', '>', 18], ['name', '!=', 'Bill']]})
+
+    def test_compile_invalid_property(self):
+        compiler = QueryCompiler(Person)
+        self.assertRaises(InvalidQuery, compiler.compile,
+                          {'filters': [['missing', '=', 1]]})
+        self.assertRaises(InvalidQuery, compiler.compile,
+                          {'order': ['data']})
+        self.assertEqual(len(compiler._cache), 0)
@@ -4,7 +4,10 @@ from aerest.resources import NDBResource
 
 from aerest.authentication import Authentication
 from aerest.authorization import Authorization
+from aerest.instrumentation import InstrumentationSink
+from aerest.profiling import MemcacheProfileStore
 
+from google.appengine.api import memcache
 from google.appengine.ext import ndb
 from aecore.models import Config
 from aecore.models import User
@@ -26,15 +29,59 @@ class PersonResource(NDBResource):
     authentication = Authentication
     authorization = [Authorization]
 
+class StreamingPersonResource(PersonResource):
+    stream_responses = True
+    stream_batch_size = 2
+
+class CachedPersonResource(PersonResource):
+    cache_entities = True
+
+class AsyncPersonResource(PersonResource):
+    use_async = True
+
+class AsyncCachedPersonResource(CachedPersonResource):
+    use_async = True
+
+class ChunkedPersonResource(PersonResource):
+    batch_size = 2
+    batch_concurrency = 2
+
+class VersionedPersonResource(PersonResource):
+    versioned = True
+
+class RecordingSink(InstrumentationSink):
+    records = []
+
+    def emit(self, request, data):
+        self.records.append((request.path, data))
+
+class InstrumentedPersonResource(PersonResource):
+    instrument = True
+    instrumentation_sink = RecordingSink
+
+class ProfiledPersonResource(PersonResource):
+    profiling = True
+
 routes = [
     PathPrefixRoute(r'/api', PersonResource.get_routes()),
+    PathPrefixRoute(r'/chunked', ChunkedPersonResource.get_routes()),
+    PathPrefixRoute(r'/async', AsyncPersonResource.get_routes()),
+    PathPrefixRoute(r'/stream', StreamingPersonResource.get_routes()),
+    PathPrefixRoute(r'/cached', CachedPersonResource.get_routes()),
+    PathPrefixRoute(r'/async-cached', AsyncCachedPersonResource.get_routes()),
+    PathPrefixRoute(r'/versioned', VersionedPersonResource.get_routes()),
+    PathPrefixRoute(r'/profiled', ProfiledPersonResource.get_routes()),
+    PathPrefixRoute(r'/instrumented',
+                    InstrumentedPersonResource.get_routes()),
     ]
 
 
 application = webapp2.WSGIApplication(routes)
+application.allowed_methods = NDBResource.get_allowed_methods(application)
 
-def create_request(method_type, resource_path, request_dict=None):
-    request = webapp2.Request.blank(resource_path)
+def create_request(method_type, resource_path, request_dict=None,
+                   headers=None):
+    request = webapp2.Request.blank(resource_path, headers=headers)
     request.method = method_type
     if request_dict is not None:
         request.body = json.dumps(request_dict)
@@ -69,6 +116,60 @@ class TestResources(BaseTestCase):
         self.assertEqual(body['person']['id'], p1.key.id())
         self.assertEqual(body['person']['name'], p1.data['name'])
 
+    def test_find_conditional(self):
+        p1 = create_person('Bill Clinton')
+        url = '/api/people/{}'.format(p1.key.id())
+        status, response, body = create_request('GET', url)
+        self.assertEqual(status, '200 OK')
+        etag = response.headers['ETag']
+        self.assertTrue(etag)
+
+        request = webapp2.Request.blank(url)
+        request.headers['If-None-Match'] = etag
+        response = request.get_response(application)
+        self.assertEqual(response.status, '304 Not Modified')
+        self.assertEqual(response.body, '')
+
+        # A changed entity gets a new ETag.
+        p1.data['name'] = 'Bill'
+        p1.put()
+        request = webapp2.Request.blank(url)
+        request.headers['If-None-Match'] = etag
+        response = request.get_response(application)
+        self.assertEqual(response.status, '200 OK')
+        self.assertNotEqual(response.headers['ETag'], etag)
+
+    def test_find_cached(self):
+        p1 = create_person('Bill Clinton')
+        id = p1.key.id()
+        url = '/cached/people/{}'.format(id)
+        cache_key = 'aerest:Person:{}'.format(id)
+
+        s1, r1, b1 = create_request('GET', url)
+        self.assertEqual(s1, '200 OK')
+        self.assertEqual(b1['person']['name'], 'Bill Clinton')
+        self.assertEqual(json.loads(memcache.get(cache_key))['id'], id)
+
+        # Hits are served without reading the datastore.
+        p1.data['name'] = 'Bill'
+        p1.put()
+        s2, r2, b2 = create_request('GET', url)
+        self.assertEqual(b2['person']['name'], 'Bill Clinton')
+
+        # Updates refresh the cache.
+        request_dict = {'person': {'id': id, 'name': 'William'}}
+        create_request('PUT', url, request_dict)
+        self.assertEqual(json.loads(memcache.get(cache_key))['name'], 'William')
+        s3, r3, b3 = create_request('GET', url)
+        self.assertEqual(b3['person']['name'], 'William')
+
+        # Deletes invalidate it.
+        s4, r4, b4 = create_request('DELETE', url)
+        self.assertEqual(s4, '200 OK')
+        self.assertEqual(memcache.get(cache_key), None)
+        s5, r5, b5 = create_request('GET', url)
+        self.assertEqual(s5, '404 Not Found')
+
     def test_find_many(self):
         p1 = create_person('Bill Clinton')
         p2 = create_person('George Washington')
@@ -101,8 +202,195 @@ class TestResources(BaseTestCase):
         self.assertEqual(b1['people'][1]['name'], p2.data['name'])
         self.assertEqual(b1['people'][2]['id'],   p3.key.id())
         self.assertEqual(b1['people'][2]['name'], p3.data['name'])
+        self.assertEqual(b1['next'], None)
+
+    def test_find_many_query(self):
+        p1 = Person(name='Bill Clinton', data={'name': 'Bill Clinton'})
+        p2 = Person(name='George Washington', data={'name': 'George Washington'})
+        p3 = Person(name='Ronald Reagan', data={'name': 'Ronald Reagan'})
+        ndb.put_multi([p1, p2, p3])
+
+        url = '/api/people'
+        request_dict = {'query': {
+            'filters': [['name', 'in', ['Bill Clinton', 'Ronald Reagan']]],
+            'order': ['-name'],
+            }}
+        s1, r1, b1 = create_request('GET', url, request_dict)
+
+        self.assertEqual(s1, '200 OK')
+        self.assertEqual(len(b1['people']), 2)
+        self.assertEqual(b1['people'][0]['name'], 'Ronald Reagan')
+        self.assertEqual(b1['people'][1]['name'], 'Bill Clinton')
+
+        request_dict = {'query': {
+            'filters': [['name', '>=', 'C']], 'order': 'name', 'limit': 1}}
+        s2, r2, b2 = create_request('GET', url, request_dict)
+
+        self.assertEqual(s2, '200 OK')
+        self.assertEqual(len(b2['people']), 1)
+        self.assertEqual(b2['people'][0]['name'], 'George Washington')
+        self.assertTrue(b2['next'] is not None)
+
+        # The unindexed `data` property cannot be queried.
+        request_dict = {'query': {'filters': [['data', '=', 'x']]}}
+        s3, r3, b3 = create_request('GET', url, request_dict)
+        self.assertEqual(s3, '400 Bad Request')
+
+    def test_find_many_paginated(self):
+        p1 = create_person('Bill Clinton')
+        p2 = create_person('George Washington')
+        p3 = create_person('Ronald Reagan')
+
+        url = '/api/people?limit=2'
+        s1, r1, b1 = create_request('GET', url)
+
+        self.assertEqual(s1, '200 OK')
+        self.assertEqual(len(b1['people']), 2)
+        self.assertEqual(b1['people'][0]['id'], p1.key.id())
+        self.assertEqual(b1['people'][1]['id'], p2.key.id())
+        self.assertTrue(b1['next'] is not None)
+
+        url = '/api/people?limit=2&cursor={}'.format(b1['next'])
+        s2, r2, b2 = create_request('GET', url)
+
+        self.assertEqual(s2, '200 OK')
+        self.assertEqual(len(b2['people']), 1)
+        self.assertEqual(b2['people'][0]['id'], p3.key.id())
+        self.assertEqual(b2['next'], None)
+
+        # Bad parameters
+        s3, r3, b3 = create_request('GET', '/api/people?limit=abc')
+        self.assertEqual(s3, '400 Bad Request')
+        s4, r4, b4 = create_request('GET', '/api/people?cursor=abc')
+        self.assertEqual(s4, '400 Bad Request')
+
+    def test_find_many_streaming(self):
+        p1 = create_person('Bill Clinton')
+        p2 = create_person('George Washington')
+        p3 = create_person('Ronald Reagan')
+        ids = [p.key.id() for p in [p1, p2, p3]]
+
+        url = '/stream/people?limit=2'
+        s1, r1, b1 = create_request('GET', url)
+
+        self.assertEqual(s1, '200 OK')
+        self.assertEqual([p['id'] for p in b1['people']], ids[:2])
+        self.assertTrue(b1['next'] is not None)
 
-        # TODO: find_query
+        url = '/stream/people?limit=2&cursor={}'.format(b1['next'])
+        s2, r2, b2 = create_request('GET', url)
+
+        self.assertEqual(s2, '200 OK')
+        self.assertEqual([p['id'] for p in b2['people']], ids[2:])
+        self.assertEqual(b2['next'], None)
+
+        # Find by ids
+        s3, r3, b3 = create_request('GET', '/stream/people', {'ids': ids})
+
+        self.assertEqual(s3, '200 OK')
+        self.assertEqual([p['id'] for p in b3['people']], ids)
+        self.assertEqual(b3['people'][0]['name'], p1.data['name'])
+
+    def test_async(self):
+        url = '/async/people'
+        request_dict = {'people': [{'name': 'Bill Clinton'},
+                                   {'name': 'Ronald Reagan'}]}
+        s1, r1, b1 = create_request('POST', url, request_dict)
+        self.assertEqual(s1, '200 OK')
+        ids = [p['id'] for p in b1['people']]
+
+        url = '/async/people/{}'.format(ids[0])
+        request_dict = {'person': {'id': ids[0], 'name': 'Bill'}}
+        s2, r2, b2 = create_request('PUT', url, request_dict)
+        self.assertEqual(s2, '200 OK')
+        self.assertEqual(Person.get_by_id(ids[0]).data['name'], 'Bill')
+
+        s3, r3, b3 = create_request('DELETE', '/async/people', {'ids': ids})
+        self.assertEqual(s3, '200 OK')
+        self.assertEqual(ndb.get_multi([ndb.Key(Person, i) for i in ids]),
+                         [None, None])
+
+    def test_async_cached(self):
+        p1 = create_person('Bill Clinton')
+        id = p1.key.id()
+        url = '/async-cached/people/{}'.format(id)
+        cache_key = 'aerest:Person:{}'.format(id)
+
+        # The cache is filled while the response is rendered, but before it
+        # is sent.
+        s1, r1, b1 = create_request('GET', url)
+        self.assertEqual(s1, '200 OK')
+        self.assertEqual(json.loads(memcache.get(cache_key))['id'], id)
+
+        request_dict = {'person': {'id': id, 'name': 'William'}}
+        s2, r2, b2 = create_request('PUT', url, request_dict)
+        self.assertEqual(s2, '200 OK')
+        self.assertEqual(json.loads(memcache.get(cache_key))['name'],
+                         'William')
+
+        s3, r3, b3 = create_request('DELETE', url)
+        self.assertEqual(s3, '200 OK')
+        self.assertEqual(memcache.get(cache_key), None)
+
+    def test_async_helpers(self):
+        handler = PersonResource(webapp2.Request.blank('/api/people'),
+                                 webapp2.Response())
+
+        @ndb.tasklet
+        def create_and_find():
+            # Both creates run concurrently.
+            e1, e2 = yield (handler.create_entity_async({'name': 'Bill'}),
+                            handler.create_entity_async({'name': 'Ron'}))
+            found = yield handler.find_entities_async(
+                [e1.key.id(), e2.key.id()])
+            raise ndb.Return(found)
+
+        found = create_and_find().get_result()
+        self.assertEqual([e.data['name'] for e in found], ['Bill', 'Ron'])
+        self.assertEqual(found[0].data['id'], found[0].key.id())
+
+    def test_chunked(self):
+        url = '/chunked/people'
+        request_dict = {'people': [{'name': str(i)} for i in range(5)]}
+        s1, r1, b1 = create_request('POST', url, request_dict)
+        self.assertEqual(s1, '200 OK')
+        ids = [p['id'] for p in b1['people']]
+        self.assertEqual(len(set(ids)), 5)
+
+        for p in b1['people']:
+            p['name'] += '!'
+        s2, r2, b2 = create_request('PUT', url, b1)
+        self.assertEqual(s2, '200 OK')
+
+        s3, r3, b3 = create_request('GET', url, {'ids': ids})
+        self.assertEqual([p['name'] for p in b3['people']],
+                         ['0!', '1!', '2!', '3!', '4!'])
+
+        s4, r4, b4 = create_request('DELETE', url, {'ids': ids})
+        self.assertEqual(s4, '200 OK')
+        self.assertEqual(b4, [None] * 5)
+
+    def test_identity_map(self):
+        p1 = create_person('Bill Clinton')
+        p2 = create_person('George Washington')
+        handler = PersonResource(webapp2.Request.blank('/api/people'),
+                                 webapp2.Response())
+
+        handler.find_entities([p1.key.id(), p2.key.id(), p1.key.id()])
+        self.assertEqual(handler.identity_map.misses, 2)
+        self.assertEqual(handler.identity_map.hits, 0)
+
+        # Updating reads nothing again.
+        handler.update_entities([{'id': p1.key.id(), 'name': 'Bill'}])
+        handler.update_entity(p2.key.id(), {'id': p2.key.id(), 'name': 'G'})
+        self.assertEqual(handler.identity_map.misses, 2)
+        self.assertEqual(handler.identity_map.hits, 2)
+        self.assertEqual(Person.get_by_id(p1.key.id()).data['name'], 'Bill')
+
+        # Deleted entities are known to be gone.
+        handler.delete_entity(p1.key.id())
+        self.assertEqual(handler._find_entity(p1.key.id()), None)
+        self.assertEqual(handler.identity_map.misses, 2)
 
     def test_create(self):
         n1 = 'Ronald Reagan'
@@ -185,6 +473,260 @@ class TestResources(BaseTestCase):
         q2 = Person.get_by_id(bs[1]['id'])
         self.assertEqual(q2.data['name'], n2)
 
+    def test_update_unchanged(self):
+        p1 = create_person('Bill Clinton')
+        p2 = create_person('George Washington')
+        handler = PersonResource(webapp2.Request.blank('/api/people'),
+                                 webapp2.Response())
+
+        puts = []
+        original = handler._put_entities_async
+        def put_entities_async(entities, *args, **kwargs):
+            puts.append([e.key.id() for e in entities])
+            return original(entities, *args, **kwargs)
+        handler._put_entities_async = put_entities_async
+
+        entities = handler.update_entities([
+            {'id': p1.key.id(), 'name': 'Bill Clinton'},
+            {'id': p2.key.id(), 'name': 'George'}])
+        self.assertEqual(len(entities), 2)
+        self.assertEqual(puts, [[p2.key.id()]])
+        self.assertEqual(handler.unchanged_ids, [p1.key.id()])
+
+        url = '/api/people'
+        request_dict = {'people': [{'id': p1.key.id(), 'name': 'Bill Clinton'},
+                                   {'id': p2.key.id(), 'name': 'G'}]}
+        s1, r1, b1 = create_request('PUT', url, request_dict)
+        self.assertEqual(s1, '200 OK')
+        self.assertEqual(b1['unchanged'], [p1.key.id()])
+        self.assertEqual(b1['people'][1]['name'], 'G')
+        self.assertEqual(Person.get_by_id(p2.key.id()).data['name'], 'G')
+
+        url = '/api/people/{}'.format(p2.key.id())
+        request_dict = {'person': {'id': p2.key.id(), 'name': 'G'}}
+        s2, r2, b2 = create_request('PUT', url, request_dict)
+        self.assertEqual(s2, '200 OK')
+        self.assertEqual(b2['unchanged'], [p2.key.id()])
+
+    def test_get_allowed_methods(self):
+        app = webapp2.WSGIApplication(PersonResource.get_routes())
+        request = webapp2.Request.blank('/people/1')
+        request.method = 'PATCH'
+        self.assertEqual(request.get_response(app).status_int, 501)
+
+        app.allowed_methods = NDBResource.get_allowed_methods(app)
+        self.assertTrue('PATCH' in app.allowed_methods)
+        self.assertTrue('GET' in app.allowed_methods)
+
+    def test_patch(self):
+        fid, lid = Person.allocate_ids(1)
+        p1 = Person(id=fid, data={'id': fid, 'name': 'Prince',
+                                  'tags': {'a': 1, 'b': 2}})
+        p1.put()
+
+        url = '/api/people/{}'.format(fid)
+        request_dict = {'person': {'name': 'Symbol', 'tags': {'a': None}}}
+        s1, r1, b1 = create_request('PATCH', url, request_dict)
+        self.assertEqual(s1, '200 OK')
+        self.assertEqual(b1['person'],
+                         {'id': fid, 'name': 'Symbol', 'tags': {'b': 2}})
+        self.assertEqual(Person.get_by_id(fid).data, b1['person'])
+
+        s2, r2, b2 = create_request('PATCH', url, request_dict)
+        self.assertEqual(s2, '200 OK')
+        self.assertEqual(b2['unchanged'], [fid])
+
+        url = '/api/people/{}'.format(fid + 1000)
+        s3, r3, b3 = create_request('PATCH', url, request_dict)
+        self.assertEqual(s3, '404 Not Found')
+
+        # Patches must be objects.
+        url = '/api/people/{}'.format(fid)
+        for patch in ['x', None, [1]]:
+            s4, r4, b4 = create_request('PATCH', url, {'person': patch})
+            self.assertEqual(r4.status_int, 400)
+        s5, r5, b5 = create_request('PATCH', url, {'people': {}})
+        self.assertEqual(r5.status_int, 400)
+        self.assertEqual(Person.get_by_id(fid).data, b1['person'])
+
+    def test_patch_many(self):
+        p1 = create_person('William Clinton')
+        p2 = create_person('Ronald Reagan')
+        missing = p2.key.id() + 1000
+
+        url = '/api/people'
+        request_dict = {'people': [{'id': p1.key.id(), 'name': 'Bill'},
+                                   {'id': p2.key.id(), 'age': 93}]}
+        s1, r1, b1 = create_request('PATCH', url, request_dict)
+        self.assertEqual(s1, '200 OK')
+        self.assertEqual(b1['people'][0]['name'], 'Bill')
+        self.assertEqual(b1['people'][1]['name'], 'Ronald Reagan')
+        self.assertEqual(Person.get_by_id(p2.key.id()).data['age'], 93)
+
+        request_dict = {'people': [{'id': p1.key.id(), 'name': None},
+                                   {'id': missing, 'name': 'Nobody'}]}
+        s2, r2, b2 = create_request('PATCH', url, request_dict)
+        self.assertEqual(r2.status_int, 207)
+        self.assertEqual(len(b2['people']), 1)
+        self.assertEqual(b2['errors'][0]['index'], 1)
+        self.assertFalse('name' in Person.get_by_id(p1.key.id()).data)
+
+        request_dict = {'people': [{'id': p1.key.id(), 'name': 'B'}, 'x']}
+        s3, r3, b3 = create_request('PATCH', url, request_dict)
+        self.assertEqual(r3.status_int, 400)
+
+    def test_versioned(self):
+        url = '/versioned/people'
+        s1, r1, b1 = create_request('POST', url, {'person': {'name': 'Bill'}})
+        self.assertEqual(b1['person']['version'], 1)
+        id = b1['person']['id']
+
+        url = '/versioned/people/{}'.format(id)
+        s2, r2, b2 = create_request('GET', url)
+        self.assertEqual(r2.etag, '1')
+
+        request_dict = {'person': {'id': id, 'name': 'William'}}
+        s3, r3, b3 = create_request('PUT', url, request_dict,
+                                    {'If-Match': '"1"'})
+        self.assertEqual(s3, '200 OK')
+        self.assertEqual(b3['person']['version'], 2)
+        self.assertEqual(r3.etag, '2')
+
+        # A writer that read version 1 has lost the race.
+        s4, r4, b4 = create_request('PUT', url, request_dict,
+                                    {'If-Match': '"1"'})
+        self.assertEqual(s4, '412 Precondition Failed')
+        request_dict = {'person': {'id': id, 'name': 'B', 'version': 1}}
+        s5, r5, b5 = create_request('PUT', url, request_dict)
+        self.assertEqual(s5, '412 Precondition Failed')
+        self.assertEqual(Person.get_by_id(id).data['name'], 'William')
+
+        # Writes without a version are not checked.
+        s6, r6, b6 = create_request('PATCH', url, {'person': {'name': 'B'}})
+        self.assertEqual(s6, '200 OK')
+        self.assertEqual(b6['person']['version'], 3)
+
+        # Unchanged data keeps its version.
+        s7, r7, b7 = create_request('PATCH', url, {'person': {'name': 'B'}})
+        self.assertEqual(b7['person']['version'], 3)
+
+        url = '/versioned/people'
+        request_dict = {'people': [{'id': id, 'name': 'C', 'version': 2}]}
+        s8, r8, b8 = create_request('PUT', url, request_dict)
+        self.assertEqual(r8.status_int, 207)
+        request_dict = {'people': [{'id': id, 'name': 'C', 'version': 3}]}
+        s9, r9, b9 = create_request('PUT', url, request_dict)
+        self.assertEqual(s9, '200 OK')
+        self.assertEqual(Person.get_by_id(id).data['version'], 4)
+
+    def test_bulk_import(self):
+        lines = ['{"name": "0"}', '{"name": "1"}', '', '{"name": ',
+                 '[1, 2]', '{"name": "2"}', '{"name": "3"}']
+        request = webapp2.Request.blank('/chunked/people/_import')
+        request.method = 'POST'
+        request.body = '\n'.join(lines)
+        response = request.get_response(application)
+        body = json.loads(response.body)
+
+        self.assertEqual(response.status_int, 207)
+        self.assertEqual(body['imported'], 4)
+        self.assertEqual([e['line'] for e in body['errors']], [4, 5])
+        people = Person.query().fetch()
+        self.assertEqual(sorted(p.data['name'] for p in people),
+                         ['0', '1', '2', '3'])
+        for p in people:
+            self.assertEqual(p.data['id'], p.key.id())
+
+    def test_bulk_export(self):
+        names = ['Bill Clinton', 'George Washington', 'Ronald Reagan']
+        for name in names:
+            create_person(name)
+
+        exported = []
+        url = '/api/people/_export?limit=2'
+        while url is not None:
+            s1, r1, b1 = create_request('GET', url)
+            self.assertEqual(s1, '200 OK')
+            lines = r1.body.splitlines()
+            self.assertTrue(len(lines) <= 2)
+            exported.extend(json.loads(line)['name'] for line in lines)
+            cursor = r1.headers.get('X-Next-Cursor')
+            url = None
+            if cursor:
+                url = '/api/people/_export?limit=2&cursor={}'.format(cursor)
+        self.assertEqual(sorted(exported), names)
+
+    def test_instrumentation(self):
+        p1 = create_person('Bill Clinton')
+        RecordingSink.records = []
+
+        url = '/instrumented/people/{}'.format(p1.key.id())
+        # Read the entity from the datastore, not from a cache.
+        context = ndb.get_context()
+        context.clear_cache()
+        context.set_memcache_policy(False)
+        s1, r1, b1 = create_request('GET', url)
+        self.assertEqual(s1, '200 OK')
+        timing = r1.headers['Server-Timing']
+        for name in ('authn;dur=', 'authz;dur=', 'handler;dur=',
+                     'render;dur=', 'total;dur=', 'datastore;dur='):
+            self.assertTrue(name in timing, timing)
+
+        path, data = RecordingSink.records[0]
+        self.assertEqual(path, url)
+        self.assertEqual(data['status'], 200)
+        self.assertEqual(data['rpcs']['datastore'], 1)
+        self.assertTrue('datastore' in data['rpc_timings'])
+        self.assertEqual(data['response_bytes'], len(r1.body))
+
+        url = '/instrumented/people'
+        s2, r2, b2 = create_request('POST', url, {'person': {'name': 'A'}})
+        path, data = RecordingSink.records[1]
+        self.assertTrue('render' in data['timings'])
+        self.assertTrue(data['request_bytes'] > 0)
+
+        url = '/instrumented/people/{}'.format(p1.key.id() + 1000)
+        s3, r3, b3 = create_request('GET', url)
+        path, data = RecordingSink.records[2]
+        self.assertEqual(data['status'], 404)
+
+        # Requests of resources that are not instrumented are not recorded.
+        create_request('GET', '/api/people/{}'.format(p1.key.id()))
+        self.assertEqual(len(RecordingSink.records), 3)
+
+    def test_profiling(self):
+        p1 = create_person('Bill Clinton')
+        url = '/profiled/people/{}'.format(p1.key.id())
+
+        class Admin(object):
+            roles = ['admin']
+
+        def profiled_request(url, value, user):
+            request = webapp2.Request.blank(
+                url, headers={'X-Aerest-Profile': value})
+            request.user = user
+            return request.get_response(application)
+
+        # Only admins may profile a request.
+        r1 = profiled_request(url, '1', None)
+        self.assertEqual(r1.status_int, 200)
+        self.assertFalse('X-Aerest-Profile-Id' in r1.headers)
+        self.assertEqual(json.loads(r1.body)['person']['id'], p1.key.id())
+
+        r2 = profiled_request(url, '1', Admin())
+        self.assertEqual(json.loads(r2.body)['person']['id'], p1.key.id())
+        stats = MemcacheProfileStore().get(r2.headers['X-Aerest-Profile-Id'])
+        self.assertTrue('function calls' in stats)
+
+        r3 = profiled_request(url, 'inline', Admin())
+        self.assertEqual(r3.content_type, 'text/plain')
+        self.assertTrue('function calls' in r3.body)
+
+        missing = '/profiled/people/{}'.format(p1.key.id() + 1000)
+        r4 = profiled_request(missing, '1', Admin())
+        self.assertEqual(r4.status_int, 404)
+        self.assertTrue(r4.headers.get('X-Aerest-Profile-Id'))
+
     def test_delete(self):
         p1 = create_person('Bill Clinton')
 
@@ -0,0 +1,98 @@
+from aecore.test_utils import BaseTestCase
+from aerest.routing import CompiledRoute
+
+import webapp2
+from webapp2_extras.routes import PathPrefixRoute
+from webob import exc
+
+
+class Handler(webapp2.RequestHandler):
+
+    def get(self, **kwargs):
+        self.response.out.write('get {}'.format(kwargs.get('id')))
+
+
+routes = [
+    webapp2.Route(r'/people', handler=Handler, handler_method='find_many', methods=['GET']),
+    webapp2.Route(r'/people', handler=Handler, handler_method='create', methods=['POST']),
+    webapp2.Route(r'/people/_export', handler=Handler, handler_method='bulk_export', methods=['GET']),
+    webapp2.Route(r'/people/_import', handler=Handler, handler_method='bulk_import', methods=['POST']),
+    webapp2.Route(r'/people/<id>', handler=Handler, handler_method='get', methods=['GET'], name='person'),
+    webapp2.Route(r'/people/<id>', handler=Handler, handler_method='delete', methods=['DELETE']),
+    webapp2.Route(r'/houses/<id>', handler=Handler, handler_method='find', methods=['GET']),
+    ]
+
+
+def match(route, method, path):
+    request = webapp2.Request.blank(path)
+    request.method = method
+    return route.match(request)
+
+
+class TestCompiledRoute(BaseTestCase):
+
+    def test_match(self):
+        route = CompiledRoute(routes)
+
+        r, args, kwargs = match(route, 'GET', '/people')
+        self.assertEqual(r.handler_method, 'find_many')
+        r, args, kwargs = match(route, 'POST', '/people')
+        self.assertEqual(r.handler_method, 'create')
+        r, args, kwargs = match(route, 'GET', '/people/12')
+        self.assertEqual((r.handler_method, kwargs), ('get', {'id': '12'}))
+        r, args, kwargs = match(route, 'GET', '/houses/1')
+        self.assertEqual(r.handler_method, 'find')
+
+        # Literal segments take precedence over variables.
+        r, args, kwargs = match(route, 'GET', '/people/_export')
+        self.assertEqual(r.handler_method, 'bulk_export')
+        r, args, kwargs = match(route, 'POST', '/people/_import')
+        self.assertEqual(r.handler_method, 'bulk_import')
+        # Unless they do not accept the method.
+        r, args, kwargs = match(route, 'GET', '/people/_import')
+        self.assertEqual((r.handler_method, kwargs),
+                         ('get', {'id': '_import'}))
+
+        self.assertEqual(match(route, 'GET', '/people/'), None)
+        self.assertEqual(match(route, 'GET', '/people/1/2'), None)
+        self.assertEqual(match(route, 'GET', '/cars'), None)
+        self.assertRaises(exc.HTTPMethodNotAllowed,
+                          match, route, 'PUT', '/people/1')
+
+    def test_unsupported_template(self):
+        self.assertRaises(ValueError, CompiledRoute, [
+            webapp2.Route(r'/people/<id:\d+>', handler=Handler)])
+
+    def test_path_prefix(self):
+        app = webapp2.WSGIApplication([
+            PathPrefixRoute(r'/api/v1', [CompiledRoute(routes)])])
+        response = webapp2.Request.blank('/api/v1/people/7').get_response(app)
+        self.assertEqual(response.body, 'get 7')
+        response = webapp2.Request.blank('/people/7').get_response(app)
+        self.assertEqual(response.status_int, 404)
+
+    def test_build(self):
+        app = webapp2.WSGIApplication([
+            PathPrefixRoute(r'/api/v1', [CompiledRoute(routes)])])
+        request = webapp2.Request.blank('/api/v1/people/7')
+        request.app = app
+        self.assertEqual(app.router.build(request, 'person', (), {'id': 3}),
+                         '/api/v1/people/3')
+        # The nested route itself is left without the prefix.
+        self.assertEqual(routes[4].template, r'/people/<id>')
+
+    def test_build_only_and_schemes(self):
+        route = CompiledRoute([
+            webapp2.Route(r'/people/<id>', handler=Handler, name='person',
+                          build_only=True),
+            webapp2.Route(r'/houses/<id>', handler=Handler,
+                          schemes=['https']),
+            ])
+        self.assertEqual(match(route, 'GET', '/people/1'), None)
+        self.assertEqual(
+            [name for name, r in route.get_build_routes()], ['person'])
+
+        self.assertEqual(match(route, 'GET', 'http://localhost/houses/1'),
+                         None)
+        r, args, kwargs = match(route, 'GET', 'https://localhost/houses/1')
+        self.assertEqual(kwargs, {'id': '1'})